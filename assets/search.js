@@ -0,0 +1,100 @@
+// Client side search over the index written by lib/search.py. Every term of
+// the query is looked up in the shard named after its first two characters,
+// so only the shards a query needs are fetched, and each of them only once.
+// The last term also matches as prefix, so results appear while typing.
+(function () {
+  const prefixLen = 2;
+  const shards = {};
+  let index = null;
+
+  function fetchJson(url) {
+    return fetch(url).then(r => r.ok ? r.json() : {});
+  }
+
+  function shard(name) {
+    if (!(name in shards)) {
+      shards[name] = fetchJson(`/search/${name}.json`);
+    }
+    return shards[name];
+  }
+
+  function tokenize(text) {
+    const stopwords = new Set(index.stopwords);
+    // like tokenize in lib/search.py: without combining marks, everything
+    // else that is not ascii separates terms
+    const terms = text.normalize("NFKD").replace(/\p{M}/gu, "")
+      .toLowerCase().match(/[a-z0-9]+/g) || [];
+    return terms.filter(t => t.length >= prefixLen && !stopwords.has(t));
+  }
+
+  async function search(query) {
+    index = index || await fetchJson("/search/docs.json");
+    const terms = tokenize(query);
+    if (!terms.length) {
+      return [];
+    }
+    const postings = await Promise.all(terms.map(t => shard(t.slice(0, prefixLen))));
+    let scores = null;
+    terms.forEach((term, i) => {
+      const isLast = i === terms.length - 1;
+      const found = new Map();
+      for (const [t, list] of Object.entries(postings[i])) {
+        if (t === term || (isLast && t.startsWith(term))) {
+          for (let j = 0; j < list.length; j += 2) {
+            found.set(list[j], (found.get(list[j]) || 0) + list[j + 1]);
+          }
+        }
+      }
+      if (scores === null) {
+        scores = found;
+      } else {
+        for (const [id, score] of scores) {
+          if (found.has(id)) {
+            scores.set(id, score + found.get(id));
+          } else {
+            scores.delete(id);
+          }
+        }
+      }
+    });
+    return [...scores].sort((a, b) => b[1] - a[1])
+      .map(([id]) => index.docs[id]).filter(doc => doc);
+  }
+
+  function card([link, title, date]) {
+    const el = (tag, cls, text) => {
+      const e = document.createElement(tag);
+      if (cls) e.className = cls;
+      if (text) e.textContent = text;
+      return e;
+    };
+    const a = el("a", "header-a", title);
+    a.href = "/" + link;
+    const p = el("p", "title");
+    p.append(a);
+    const header = el("div", "card-header");
+    const left = el("div", "left-half");
+    left.append(p);
+    header.append(left, el("p", "date", date));
+    const c = el("div", "card");
+    c.append(header);
+    return c;
+  }
+
+  const box = document.getElementById("search-box");
+  const cards = document.getElementById("cards");
+  let latest = 0;
+  box.addEventListener("input", async () => {
+    const n = ++latest;
+    const results = await search(box.value);
+    if (n === latest) {
+      cards.replaceChildren(...results.map(card));
+    }
+  });
+  const query = new URLSearchParams(location.search).get("q");
+  if (query) {
+    box.value = query;
+    box.dispatchEvent(new Event("input"));
+  }
+  box.focus();
+})();
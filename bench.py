@@ -0,0 +1,200 @@
+"""
+Benchmarks for the build pipeline on synthetic corpora.
+
+    python bench.py [--sizes 10,1000,10000] [--baseline bench_baseline.json]
+                    [--threshold 0.2] [--save-baseline]
+
+Every corpus size runs in its own process, in a temporary directory with
+generated posts and the real assets. Each stage is timed twice: cold, with
+empty caches, and warm, right after. The peak RSS of the process is
+reported too. Results are compared to the baseline file, if it exists, and
+the exit code is 1 if a stage got slower than threshold allows.
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess as sp
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+repo = Path(__file__).resolve().parent
+stages = ["parse_post", "md_2_html", "render.index", "render.post", "css.render", "make_dist"]
+# differences below this many seconds are noise
+noise_floor = 0.005
+
+words = ("the a of to and in is it that for on with as was this be by are we from "
+         "function value type error build index render trait macro compile lexer parser "
+         "memory cache python rust latency thread process socket file stream").split()
+code_blocks = [
+    ("python", "def f(xs):\n    return [x * 2 for x in xs if x % 3]\n\nprint(f(range({n})))"),
+    ("rust", "fn main() {{\n    let v: Vec<u32> = (0..{n}).filter(|x| x % 2 == 0).collect();\n"
+             "    println!(\"{{:?}}\", v);\n}}"),
+    ("", "$ cargo build --release\n   Compiling blog v0.{n}.0\n    Finished release"),
+]
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["--run-one"]:
+        print(json.dumps(run_one(int(args[1]))))
+        return
+
+    sizes = [10, 1000, 10000]
+    baseline_path = repo / "bench_baseline.json"
+    threshold = 0.2
+    save = False
+    args = iter(args)
+    for arg in args:
+        match arg:
+            case "--sizes":
+                sizes = [int(s) for s in next(args).split(",")]
+            case "--baseline":
+                baseline_path = Path(next(args))
+            case "--threshold":
+                threshold = float(next(args))
+            case "--save-baseline":
+                save = True
+            case _:
+                raise SystemExit(f"Unknown argument: {arg}")
+
+    results = {}
+    for size in sizes:
+        print(f"running {size} posts ...", flush=True)
+        out = sp.run([sys.executable, __file__, "--run-one", str(size)], check=True,
+                     capture_output=True, text=True, cwd=repo).stdout
+        results[str(size)] = json.loads(out.splitlines()[-1])
+
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    regressions = report(results, baseline, threshold)
+    if save:
+        baseline.update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2))
+        print(f"saved baseline to {baseline_path}")
+    sys.exit(1 if regressions and not save else 0)
+
+
+def report(results, baseline, threshold):
+    """prints the results next to the baseline, and returns the list of
+    regressions"""
+    regressions = []
+    print(f"\n{'posts':>6} {'stage':<14} {'pass':<5} {'seconds':>10} {'baseline':>10} {'change':>8}")
+    for size, res in results.items():
+        base = baseline.get(size, {})
+        for pass_ in ("cold", "warm"):
+            for stage in stages:
+                t = res[pass_][stage]
+                b = base.get(pass_, {}).get(stage)
+                change = ""
+                if b is not None:
+                    change = f"{(t - b) / b:+.0%}" if b > 0 else ""
+                    if t > b * (1 + threshold) and t - b > noise_floor:
+                        regressions.append((size, stage, pass_))
+                        change += " !"
+                b_str = f"{b:.4f}" if b is not None else "-"
+                print(f"{size:>6} {stage:<14} {pass_:<5} {t:>10.4f} {b_str:>10} {change:>8}")
+        base_rss = base.get("peak_rss_mb")
+        rss_change = ""
+        if base_rss:
+            rss_change = f"{(res['peak_rss_mb'] - base_rss) / base_rss:+.0%}"
+            if res["peak_rss_mb"] > base_rss * (1 + threshold):
+                regressions.append((size, "peak_rss_mb", ""))
+                rss_change += " !"
+        base_rss_str = f"{base_rss:.1f}" if base_rss else "-"
+        print(f"{size:>6} {'peak rss MB':<14} {'':<5} {res['peak_rss_mb']:>10.1f} "
+              f"{base_rss_str:>10} {rss_change:>8}")
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {threshold:.0%}:")
+        for r in regressions:
+            print("   ", *r)
+    return regressions
+
+
+def run_one(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        make_corpus(tmp / "posts", size)
+        (tmp / "assets").symlink_to(repo / "assets")
+        (tmp / "code.css").symlink_to(repo / "code.css")
+        os.chdir(tmp)
+        sys.path.insert(0, str(repo))
+        import blog
+        from lib import css, render
+
+        res = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for pass_ in ("cold", "warm"):
+                res[pass_] = run_stages(blog, render, css, tmp / "dist")
+        res["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        os.chdir(repo)
+        return res
+
+
+def run_stages(blog, render, css, dist_dir):
+    paths = sorted(Path("posts").glob("*.md"))
+    texts = [p.read_text() for p in paths]
+    times = {}
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        res = fn()
+        times[name] = time.perf_counter() - start
+        return res
+
+    posts = timed("parse_post", lambda: {
+        path: info for path, text in zip(paths, texts)
+        for path, info in blog.parse_post(text, path).items()})
+    timed("md_2_html", lambda: [blog.md_2_html(t) for t in texts])
+    ordered = dict(sorted(posts.items(), key=lambda x: x[1]["dt"], reverse=True))
+    timed("render.index", lambda: render.index(ordered))
+    timed("render.post", lambda: [render.post(info) for info in posts.values()])
+    timed("css.render", lambda: render.css_files.__wrapped__())
+    timed("make_dist", lambda: blog.make_dist(dist_dir, posts))
+    return times
+
+
+def make_corpus(posts_dir, size, seed=0):
+    """writes size posts with front matter, an excerpt, code blocks and
+    math. The content only depends on size and seed."""
+    rnd = random.Random(seed)
+    posts_dir.mkdir(parents=True)
+    for i in range(size):
+        day = time.gmtime(1262304000 + i * 86400)
+        date = time.strftime("%Y-%m-%d", day)
+
+        def sentence(n):
+            return " ".join(rnd.choice(words) for _ in range(n)).capitalize() + "."
+
+        def paragraph():
+            return " ".join(sentence(rnd.randint(6, 18)) for _ in range(rnd.randint(2, 6)))
+
+        tags = " ".join(rnd.sample(words[20:], 3))
+        body = [paragraph(), "<!--more-->", f"## {sentence(4)}", paragraph()]
+        for _ in range(rnd.randint(1, 4)):
+            lang, code = rnd.choice(code_blocks)
+            body += [f"```{lang}\n{code.format(n=rnd.randint(1, 100))}\n```", paragraph()]
+        if rnd.random() < 0.3:
+            body += ["$$\n\\sum_{i=0}^{n} x_i^2 = \\frac{a}{b}\n$$",
+                     f"Inline math \\(x^{rnd.randint(2, 9)}\\) in {sentence(5)}"]
+        body += [f"- {sentence(5)}" for _ in range(rnd.randint(0, 5))]
+        (posts_dir / f"{date}-post-{i}.md").write_text("\n".join([
+            "---",
+            "layout: post",
+            f"title: {sentence(rnd.randint(3, 8))[:-1]}",
+            f"permalink: /blog/post-{i}.html",
+            "excerpt_separator: <!--more-->",
+            f"categories: {rnd.choice(['programming', 'python', 'rust'])}",
+            f"tags: {tags}",
+            "---",
+            "",
+            "\n\n".join(body),
+            "",
+        ]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,95 +1,805 @@
 import sys
+import time
+
+from lib import daemon
+
+started = time.time()
+if __name__ == "__main__":
+    # a running build daemon takes the command before the imports below
+    daemon.run_client(sys.argv[1:], started)
+
+import asyncio
+import threading
+import traceback
 from importlib import reload
 from pathlib import Path
 import subprocess as sp
 import atexit
-import shutil
-import time
 import datetime as dt
+import hashlib
+import multiprocessing
+from bisect import bisect_left, insort
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
 import markdown as md
+import pygments
 
-from lib import render
+from lib import (compress, critical, css, deploy, fingerprint, highlight, html, markup, minify,
+                 render, search, watch)
+from lib.assets import AssetSync
+from lib.cache import Cache, file_hash
+from lib.graph import Graph
+from lib.images import Images
+from lib.metadata import PostIndex
+from lib.profiling import profiler
+from lib.server import DevServer
 
 
-files_to_watch = [Path("lib/render.py")] + list(Path().glob("posts/*.md"))
+md_extensions = markup.extensions
+md_cache = Cache(".cache/md", md.__version__, pygments.__version__, *md_extensions)
+hl_cache = Cache(".cache/hl", md.__version__, pygments.__version__)
+caches = [md_cache, hl_cache]
+highlight.install(hl_cache)
+post_index = PostIndex(".cache/posts.db", md.__version__, pygments.__version__, search.version,
+                       *md_extensions)
+jobs = 1
+
 
 def main():
-    print(repr(files_to_watch))
-    match sys.argv[1:]:
+    args, opts = parse_opts(sys.argv[1:])
+    match args:
         case ["serve"]:
-            serve()
+            _apply_opts(opts)
+            serve(opts["port"], opts["images"], opts["page-size"])
+        case ["daemon"]:
+            run_daemon()
+        case _:
+            first_output = run(args, opts)
+            if args[0] == "build":
+                daemon.report_times(started, first_output)
+
+
+def run(args, opts, sites=None):
+    """runs a build or publish command. sites keeps the sites of earlier
+    builds in the daemon, they are updated instead of built from scratch.
+    Returns the time of the first output of a build, or None"""
+    global jobs
+    _apply_opts(opts)
+    for cache in caches:
+        cache.hits = cache.misses = 0
+    first_output = None
+    match args:
         case ["build", path]:
-            dist_dir = Path("/tmp/bloghost")
-            post_infos = parse_posts()
-            make_dist(Path(path), post_infos)
+            if opts["profile"]:
+                if jobs > 1:
+                    print("--profile builds serially, ignoring --jobs")
+                    jobs = 1
+                profiler.start()
+            try:
+                with profiler.span("parse_posts"):
+                    post_infos = parse_posts()
+                with profiler.span("make_dist"):
+                    site = _kept_site(sites, Path(path), post_infos, opts)
+                first_output = site.first_output
+                if opts["compress"]:
+                    with profiler.span("compress"):
+                        compress.precompress(path, site.graph.rules)
+            finally:
+                if opts["profile"]:
+                    profiler.stop()
+            if opts["profile"]:
+                profiler.report()
+                profiler.write_trace("build-profile.json")
+        case ["publish", target]:
+            deploy.publish(opts["dist"], target, opts["dry-run"])
+            return None
         case _: 
-            raise "Invalid argument"
+            raise SystemExit("Invalid argument")
+    for cache in caches:
+        print(cache.stats())
+        cache.gc()
+    return first_output
+
+
+def _apply_opts(opts):
+    global jobs
+    for cache in caches:
+        cache.enabled = not opts["no-cache"]
+    post_index.enabled = not opts["no-cache"]
+    jobs = opts["jobs"]
+
+
+def _kept_site(sites, dist_dir, posts, opts):
+    """builds dist_dir. With sites, a site from an earlier build of the same
+    dist_dir and options is updated, if dist_dir was not changed since:
+    neither its manifest, nor the size of any output"""
+    if sites is None:
+        return make_dist(dist_dir, posts, opts["images"], opts["minify"], opts["page-size"],
+                         critical_css=opts["critical-css"])
+    key = (str(dist_dir.resolve()), opts["images"], opts["minify"], opts["page-size"],
+           opts["critical-css"])
+    kept = sites.pop(key, None)
+    if (kept is not None and kept[2] == _manifest_state(dist_dir)
+            and kept[0].manifest.intact()):
+        site, statics = kept[:2]
+        new_statics = _static_state()
+        changed = [p for p in statics.keys() | new_statics.keys()
+                   if statics.get(p) != new_statics.get(p)]
+        update_dist(site, posts, sorted(changed))
+    else:
+        site = make_dist(dist_dir, posts, opts["images"], opts["minify"], opts["page-size"],
+                         critical_css=opts["critical-css"])
+        new_statics = _static_state()
+    sites[key] = (site, new_statics, _manifest_state(dist_dir))
+    return site
+
+
+def _static_state():
+    files = [p for p in Path("assets").rglob("*") if p.is_file()] + [Path("code.css")]
+    return {p: (st.st_mtime_ns, st.st_size) for p in files for st in [p.stat()]}
+
+
+def _manifest_state(dist_dir):
+    try:
+        st = (dist_dir / deploy.manifest_name).stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def run_daemon():
+    """keeps serving build commands from blog.py clients, until
+    blog.py or lib changes"""
+    sites = {}
+    code = _code_state()
+
+    def handle(argv):
+        args, opts = parse_opts(argv)
+        return run(args, opts, sites)
+
+    daemon.serve_forever(handle, lambda: _code_state() == code)
+
+
+def _code_state():
+    return {p: p.stat().st_mtime_ns
+            for p in [Path(__file__), *Path(__file__).parent.glob("lib/*.py")]}
+
+
+def parse_opts(argv):
+    """splits argv into positional args and --options. Options with a bool
+    default are flags, all others take a value (`--name value` or
+    `--name=value`) which is converted to the type of the default"""
+    opts = {"no-cache": False, "jobs": 1, "port": 8080, "compress": False,
+            "images": False, "minify": False, "profile": False, "page-size": 10,
+            "dist": "/tmp/blog_dist", "dry-run": False, "no-daemon": False,
+            "critical-css": False}
+    args = []
+    argv = iter(argv)
+    for arg in argv:
+        if arg.startswith("--"):
+            name, has_val, val = arg[2:].partition("=")
+            if name not in opts:
+                raise SystemExit(f"Unknown option: --{name}")
+            if isinstance(opts[name], bool):
+                opts[name] = True
+            else:
+                if not has_val:
+                    val = next(argv, None)
+                if val is None:
+                    raise SystemExit(f"Missing value for --{name}")
+                opts[name] = type(opts[name])(val)
+        else:
+            args.append(arg)
+    return args, opts
+
+
+def pmap(fn, items):
+    """like map, but fans out over a process pool if jobs > 1. The results
+    are returned as list in the order of items. While other threads run,
+    like in serve, the workers come from a fork server, as a forked child
+    could inherit locks that they hold"""
+    items = list(items)
+    if jobs <= 1 or len(items) < 2:
+        return list(map(fn, items))
+    chunksize = max(1, len(items) // (jobs * 4))
+    context = multiprocessing.get_context("forkserver" if threading.active_count() > 1 else None)
+    with ProcessPoolExecutor(jobs, mp_context=context, initializer=_init_worker,
+                             initargs=(md_cache.enabled,)) as pool:
+        return list(pool.map(fn, items, chunksize=chunksize))
+
+
+def _init_worker(cache_enabled):
+    for cache in caches:
+        cache.enabled = cache_enabled
+
+
+def serve(port, images, page_size):
+    site = make_dist(None, parse_posts(), images, page_size=page_size, lazy=True)
+    for cache in caches:
+        print(cache.stats())
+    try:
+        asyncio.run(_serve(site, port))
+    except KeyboardInterrupt:
+        pass
 
 
-def serve():
-    dist_dir = Path("/tmp/bloghost")
-    post_infos = parse_posts()
-    make_dist(dist_dir, post_infos)
+async def _serve(site, port):
+    """Serves site and rebuilds it on changes, all on one event loop. The
+    watcher runs on its own thread, rebuilds on a single worker thread, so
+    only one of them changes the site at a time, and the server keeps
+    answering with the outputs of the last build. A change during a rebuild
+    cancels it, and the next one starts with all pending changes."""
+    loop = asyncio.get_running_loop()
+    server = DevServer(site.outputs, port=port)
+    await server.start()
 
-    change_tss = { file: file.stat().st_mtime
-            for file in files_to_watch }
+    changes = asyncio.Queue()
+    watcher = watch.watcher(["posts", "lib", "assets"], ["code.css"])
 
+    def watch_thread():
+        while True:
+            loop.call_soon_threadsafe(changes.put_nowait, watcher.wait())
+
+    threading.Thread(target=watch_thread, daemon=True).start()
+    builder = ThreadPoolExecutor(1, thread_name_prefix="rebuild")
+    pending = set()
+    rebuild = None
     while True:
-        for file, last_updt in change_tss.items():
-            last_updt_new = file.stat().st_mtime 
-            if last_updt_new > last_updt:
-                if file.name == "render.py":
-                    print("rerendering because render.py changed")
-                    reload(render)
-                    make_dist(dist_dir, post_infos)
-                else:
-                    post_info = parse_post(file.read_text(), file)
-                    post_infos.update(post_info)
-                    post_infos = dict(sorted(post_infos.items(), key=lambda d: int(dt.datetime.timestamp(d[1]["dt"])), 
-                                    reverse=True))
-                    render_and_write_post(dist_dir, next(iter(post_info.values())))
-                    
-                change_tss[file] = last_updt_new
-        time.sleep(0.3)
-            
+        pending |= await changes.get()
+        if rebuild is not None and not rebuild.done():
+            print("restarting the rebuild")
+            rebuild.cancel()
+        rebuild = asyncio.create_task(_rebuild(site, server, builder, pending))
+
+
+async def _rebuild(site, server, builder, pending):
+    changed = set(pending)
+    cancel = threading.Event()
+    try:
+        written = await asyncio.get_running_loop().run_in_executor(
+            builder, _apply_changes, site, changed, cancel)
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+    except Exception:
+        # the changes stay pending, and are applied again with the next one
+        traceback.print_exc()
+        print("rebuild failed")
+        return
+    pending -= changed
+    print(f"rebuilt {len(written)} outputs")
+    server.notify_reload()
+
+
+def _apply_changes(site, changed, cancel):
+    """updates site with the changed files and builds it. Outputs that were
+    already rendered are rendered again right away, so the server can keep
+    the old version until the new one is there. Stops early with
+    _Cancelled once cancel is set"""
+    if _touches(changed, "lib", ".py"):
+        print("rerendering because lib changed")
+        _reload(html, css, render)
+        site.graph.touch("render")
+
+    if _touches(changed, "posts", ".md"):
+        posts = parse_posts()
+        for path in site.posts.keys() - posts.keys():
+            site.remove_post(path)
+        for path, info in posts.items():
+            site.update_post(path, info)
+    for file in sorted(changed):
+        if file.parts[0] == "assets" or file.name == "code.css":
+            site.update_static(file)
+    return site.build(partial(_cancellable_map, cancel))
+
+
+def _reload(*modules):
+    """reloads modules, or none of them, if one fails. render refers to the
+    classes of html, so they must not be reloaded separately"""
+    saved = [dict(mod.__dict__) for mod in modules]
+    try:
+        for mod in modules:
+            reload(mod)
+    except BaseException:
+        for mod, namespace in zip(modules, saved):
+            mod.__dict__.clear()
+            mod.__dict__.update(namespace)
+        raise
+
+
+def _touches(changed, root, suffix):
+    """whether changed has a file with suffix below root, or a directory,
+    which the watcher reports if it lost events, or if one was deleted"""
+    return any(p.parts[0] == root and p.suffix in (suffix, "") for p in changed)
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _cancellable_map(cancel, fn, items):
+    for item in items:
+        if cancel.is_set():
+            raise _Cancelled
+        yield fn(item)
+
 
 def parse_posts():
-    res = {}
-    for post in Path().glob("posts/*.md"):
-        res.update(parse_post(post.read_text(), post))
-    return dict(sorted(res.items(), key=lambda d: int(dt.datetime.timestamp(d[1]["dt"])), 
-                    reverse=True))
+    """returns the infos of all posts, without their bodies. Only posts that
+    changed since the last run are parsed, the others come from post_index"""
+    paths = sorted(Path().glob("posts/*.md"))
+    counts = [[c.hits, c.misses] for c in caches]
+    for (path, info, st), post_counts in pmap(_parse_file, post_index.stale(paths)):
+        post_index.put(path, info, st)
+        for total, (hits, misses) in zip(counts, post_counts):
+            total[0] += hits
+            total[1] += misses
+    for cache, (hits, misses) in zip(caches, counts):
+        cache.hits, cache.misses = hits, misses
+    infos = post_index.load(paths)
+    return {path: infos[path] for path in paths}
+
+
+def make_dist(dist_dir, posts, images=False, minify=False, page_size=10, lazy=False,
+              critical_css=False):
+    site = Site(dist_dir, Images() if images else None, minify, page_size, lazy, critical_css)
+    update_dist(site, posts, [Path("assets"), Path("code.css")])
+    return site
+
+
+def update_dist(site, posts, statics):
+    """updates site to posts, which are all posts, and the static files or
+    directories in statics, which changed, and builds it"""
+    if site.assets is not None:
+        site.assets.copied = site.assets.skipped = 0
+        site.manifest.written = site.manifest.unchanged = 0
+    # statics first, the pages of posts depend on their fingerprints
+    for static in statics:
+        site.update_static(static)
+    for path in site.posts.keys() - posts.keys():
+        site.remove_post(path)
+    for path, info in posts.items():
+        site.update_post(path, info)
+    if site.assets is not None:
+        site.assets.prune(site.graph.rules)
+    site.build()
+    if site.assets is not None:
+        site.manifest.prune(site.graph.rules)
+        site.manifest.save()
+        print(site.assets.stats())
+        print(site.manifest.stats())
+
+
+class Site:
+    """The posts of the blog, kept in date order, and the build graph of all
+    outputs. Changes are applied through update_post, remove_post and
+    update_static, and build() regenerates what they made stale.
+    The current outputs are kept in self.outputs, as str, or as Path for
+    copied files. They are also written to dist_dir, unless it is None, but
+    only if their content changed.
+    If images is given, it derives resized versions of images, and html
+    outputs are rewritten to use them. With minify, rendered html and css
+    outputs are minified. The index is split into pages of page_size
+    posts, or not at all if it is 0, and every tag and category gets an
+    archive page listing its posts. The search index is updated with the
+    text of every changed post, and only its changed shards are written.
+    Post pages that are up to date in dist_dir are not rendered again.
+    Builds into dist_dir reference stylesheets, scripts and images by
+    fingerprinted copies, see lib/fingerprint.py. With critical_css, the
+    rules html outputs need for their first screen are inlined, and their
+    stylesheets deferred, see lib/critical.py. With lazy, outputs are only
+    rendered when they are first requested from self.outputs, see
+    DevServer, and after that by build, as usual."""
+    card_keys = ("title", "link", "date", "tags", "categories", "excerpt")
+
+    def __init__(self, dist_dir, images=None, minify=False, page_size=10, lazy=False,
+                 critical_css=False):
+        self.dist_dir = dist_dir
+        self.images = images
+        self.minify = minify
+        self.page_size = page_size
+        self.lazy = lazy
+        self.critical_css = critical_css
+        self.derived = {}
+        self.posts = {}
+        self.order = []
+        self.card_revs = {}
+        self.listings = {}
+        self._cards_changed = True
+        self.search = search.SearchIndex(
+            search.load_docs(dist_dir / "search/docs.json") if dist_dir is not None else ())
+        self.static = set()
+        self.outputs = {}
+        self.assets = AssetSync(dist_dir) if dist_dir is not None else None
+        self.manifest = deploy.OutputManifest(dist_dir) if dist_dir is not None else None
+        self.fingerprints = fingerprint.Fingerprints() if dist_dir is not None else None
+        # image rewriting depends on more than the sources, so with images
+        # everything is rendered
+        self.fingerprint = (_render_fingerprint(minify, critical_css)
+                            if dist_dir is not None and images is None else None)
+        self.source_keys = {}
+        self.first_output = None
+        self.graph = Graph()
+        self.graph.add("about_me.html", _render_about_me, ["render"])
+        self.graph.add("search.html", _render_search, ["render"])
+        # the css of the stylesheets pages link to, by url, for critical_css
+        self.stylesheets = {}
+        for name, content in render.css_files().items():
+            self.graph.add(name, partial(_render_css_file, name), ["render"])
+            if critical_css:
+                self.stylesheets["/" + name] = content
+            if self.fingerprints is not None:
+                self._fingerprint(name, fingerprint.digest(content.encode(), minify))
+        if self.fingerprints is not None:
+            self.graph.add(fingerprint.headers_output, self.fingerprints.headers,
+                           ["fingerprints"])
+
+    def update_post(self, path, info):
+        old = self.posts.get(path)
+        if old == info:
+            return
+        if old is not None:
+            self._remove_outputs(old, info)
+            del self.order[bisect_left(self.order, _sort_key(path, old))]
+        self.posts[path] = info
+        insort(self.order, _sort_key(path, info))
+        self.search.update(path, info)
+
+        if old is None or any(old.get(k) != info.get(k) for k in self.card_keys):
+            self.card_revs[path] = self.card_revs.get(path, 0) + 1
+            self._cards_changed = True
+        key = self._source_key(info)
+        self.source_keys[info["link"]] = key
+        self.graph.add(info["link"], partial(_render_post, info), ["render", path],
+                       stale=key is None or not self.manifest.fresh(info["link"], key))
+        if "extralink" in info and (old is None or (old["link"], old.get("extralink"))
+                                    != (info["link"], info["extralink"])):
+            self.graph.add(info["extralink"].lstrip("/"), partial(_render_redirect, info["link"]),
+                           ["render", path])
+
+    def remove_post(self, path):
+        if path not in self.posts:
+            return
+        print(f"removing {path}")
+        info = self.posts.pop(path)
+        self._remove_outputs(info)
+        del self.order[bisect_left(self.order, _sort_key(path, info))]
+        del self.card_revs[path]
+        self._cards_changed = True
+        self.search.remove(path)
+
+    def _update_listings(self):
+        """Derives the index pages and the tag and category archives from the
+        ordered posts. A listing is identified by its posts, the revisions of
+        their cards, and its own parameters, like the page number. Only
+        listings where that changed are rendered again."""
+        paths = [path for _, path in self.order]
+        size = self.page_size or max(len(paths), 1)
+        n_pages = max(1, -(-len(paths) // size))
+        listings = {}
+        for i in range(n_pages):
+            listings[_page_output(i + 1)] = (
+                _render_index, paths[i * size: (i + 1) * size], (i + 1, i + 1 < n_pages))
+        for (kind, _), (name, members) in archive_index(paths, self.posts).items():
+            listings[render.archive_link(kind, name).lstrip("/")] = (
+                _render_archive, members, (kind, name))
+
+        for output, (fn, members, params) in listings.items():
+            key = (tuple((p, self.card_revs[p]) for p in members), params)
+            if self.listings.get(output) != key:
+                self.graph.add(output, partial(fn, self.posts, members, *params), ["render"])
+                self.listings[output] = key
+        for output in self.listings.keys() - listings.keys():
+            self.graph.remove(output)
+            del self.listings[output]
+        self._cards_changed = False
+
+    def _source_key(self, info):
+        """identifies everything the page of a post is rendered from, or is
+        None if that is unknown"""
+        if self.fingerprint is None or "hash" not in info:
+            return None
+        return hashlib.sha256(f"{self.fingerprint}\0{self.fingerprints.key()}"
+                              f"\0{info['hash']}".encode()).hexdigest()
+
+    def _remove_outputs(self, info, new=None):
+        """removes the outputs of info, that are not produced by new anymore"""
+        new = new or {}
+        if info["link"] != new.get("link"):
+            self.graph.remove(info["link"])
+            self.source_keys.pop(info["link"], None)
+        if "extralink" in info and info["extralink"] != new.get("extralink"):
+            self.graph.remove(info["extralink"].lstrip("/"))
+
+    def update_static(self, path):
+        """path is a file or directory below assets or code.css. Existing files
+        are (re)copied, removed ones deleted from dist_dir. For a directory,
+        that is done for all files below it"""
+        if path.is_dir():
+            for file in sorted(path.rglob("*")):
+                if file.is_file():
+                    self.update_static(file)
+        elif path.is_file():
+            self.static.add(path)
+            self.graph.add(str(path), partial(Path, path), [path])
+            if self.critical_css and path.suffix == ".css":
+                self._update_stylesheet(path, path.read_text())
+            derived = {}
+            if self.images is not None and self.images.handles(path):
+                derived = self.images.derived(path)
+                self._update_derived(path, derived)
+            outputs = [o for o in {str(path), *derived} if fingerprint.handles(o)]
+            if self.fingerprints is not None:
+                # derived outputs depend on the image settings too, so they
+                # are made (or taken from the image cache) to hash what they
+                # contain
+                for output in sorted(outputs):
+                    made = derived[output]() if output in derived else path
+                    self._fingerprint(output, file_hash(made, self.minify, output))
+            return
+        gone = {p for p in self.static if (p == path or path in p.parents) and not p.is_file()}
+        for p in gone:
+            self.static.discard(p)
+            self.graph.remove(str(p))
+            self._unfingerprint(str(p))
+            self._update_stylesheet(p, None)
+            self._update_derived(p, {})
 
+    def _update_derived(self, path, rules):
+        for output in self.derived.pop(path, set()) - rules.keys() - {str(path)}:
+            self.graph.remove(output)
+            self._unfingerprint(output)
+        for output, rule in rules.items():
+            self.graph.add(output, rule, [path])
+        if rules:
+            self.derived[path] = set(rules)
 
-def make_dist(dist_dir, posts):
-    dist_dir.joinpath("posts").mkdir(exist_ok=True, parents=True)
-    dist_dir.joinpath("blog").mkdir(exist_ok=True, parents=True)
-    dist_dir.joinpath("index.html").write_text(render.index(posts))
-    dist_dir.joinpath("about_me.html").write_text(render.about_me())
-    shutil.copytree("assets", dist_dir/"assets", dirs_exist_ok=True)
-    shutil.copy("code.css", dist_dir/"code.css")
+    def _update_stylesheet(self, path, content):
+        url = "/" + str(path)
+        if self.stylesheets.get(url) == content:
+            return
+        if content is None:
+            del self.stylesheets[url]
+        else:
+            self.stylesheets[url] = content
+        # pages inline it
+        self.graph.touch("render")
 
-    for infos in posts.values():
-        render_and_write_post(dist_dir, infos)
+    def _fingerprint(self, output, digest):
+        """adds the fingerprinted copy of output, which has the same rule and
+        inputs, for the given digest of its content"""
+        if self.fingerprints is None or not fingerprint.handles(output):
+            return
+        changed = self.fingerprints.set(output, digest)
+        if changed is None:
+            return
+        old, copy = changed
+        if old is not None:
+            self.graph.remove(old)
+        self.graph.add(copy, self.graph.rules[output], self.graph.inputs[output])
+        self._fingerprints_changed()
 
-    for path, content in render.css_files().items():
-        dist_dir.joinpath(path).write_text(content)
+    def _unfingerprint(self, output):
+        copy = self.fingerprints.remove(output) if self.fingerprints is not None else None
+        if copy is not None:
+            self.graph.remove(copy)
+            self._fingerprints_changed()
 
+    def _fingerprints_changed(self):
+        # any page may reference the changed copy
+        self.graph.touch("render", "fingerprints")
+        for info in self.posts.values():
+            self.source_keys[info["link"]] = self._source_key(info)
 
-def render_and_write_post(dist_dir, infos):
-    dist_dir.joinpath(infos["link"]).write_text(render.post(infos))
-    if "extralink" in infos:
-        dist_dir.joinpath(infos["extralink"].lstrip('/')).write_text(render.redirect_page(infos['link']))
+    def build(self, mapper=pmap):
+        self.first_output = None
+        if self._cards_changed:
+            self._update_listings()
+        for output, data in self.search.take_dirty().items():
+            if data is None:
+                self.graph.remove(output)
+            else:
+                self.graph.add(output, partial(search.render_json, data), [])
+        written = self.graph.build(self._write, self._delete, mapper,
+                                   self._defer if self.lazy else None)
+        if self.assets is not None:
+            self.assets.save()
+            self.manifest.save()
+        return written
+
+    def _write(self, output, content):
+        if self.images is not None and isinstance(content, str) and output.endswith(".html"):
+            with profiler.span("images.rewrite"):
+                content = self.images.rewrite(content)
+        if self.critical_css and isinstance(content, str) and output.endswith(".html"):
+            with profiler.span("critical css"):
+                content = critical.inline(content, self.stylesheets)
+        if self.fingerprints is not None and isinstance(content, str) and output.endswith(".html"):
+            with profiler.span("fingerprints.rewrite"):
+                content = self.fingerprints.rewrite(content)
+        if self.minify:
+            with profiler.span("minify"):
+                content = _minified(output, content)
+        self.outputs[output] = content
+        if self.dist_dir is None:
+            written = True
+        elif isinstance(content, Path):
+            with profiler.span("asset sync"):
+                written = self.assets.sync(content, output)
+            entry = self.assets.manifest[output]
+            self.manifest.record(output, entry["hash"], entry["target"][0])
+        else:
+            with profiler.span("write"):
+                written = self.manifest.write_text(output, content, self.source_keys.get(output))
+        if written and self.first_output is None:
+            self.first_output = time.time()
+
+    def _defer(self, output, rule):
+        """defers outputs that were not rendered yet, until they are
+        requested. Rendered ones are rendered again by build"""
+        if output in self.outputs and not callable(self.outputs[output]):
+            return False
+
+        def render():
+            content = rule()
+            if self.outputs.get(output) is render:
+                self._write(output, content)
+                content = self.outputs[output]
+            return content
+        self.outputs[output] = render
+        return True
+
+    def _delete(self, output):
+        self.outputs.pop(output, None)
+        if self.dist_dir is None:
+            return
+        if output in self.assets.manifest:
+            self.assets.delete(output)
+        self.manifest.delete(output)
+
+
+def _minified(output, content):
+    """minifies rendered html and css, and code.css. Other copied files are
+    left as they are"""
+    if isinstance(content, Path):
+        if output.startswith("assets/") or not output.endswith(".css"):
+            return content
+        content = content.read_text()
+    if output.endswith(".html"):
+        return minify.minify_html(content)
+    if output.endswith(".css"):
+        return minify.minify_css(content)
+    return content
+
+
+def _sort_key(path, info):
+    return (-info["dt"].timestamp(), path)
+
+
+def _page_output(page):
+    return render.page_link(page).lstrip("/")
+
+
+def _render_index(posts, members, page, has_next):
+    with profiler.span("render.index"):
+        return render.index({path: posts[path] for path in members}, page, has_next)
+
+
+def _render_archive(posts, members, kind, name):
+    with profiler.span("render.archive"):
+        return render.archive(kind, name, {path: posts[path] for path in members})
+
+
+def archive_index(paths, posts):
+    """maps (kind, slug) of every tag and category to its name and the
+    paths of its posts, in the order of paths. Kind is "tags" or
+    "categories". This is a single pass over the posts."""
+    index = {}
+    for path in paths:
+        info = posts[path]
+        for kind in ("tags", "categories"):
+            for name in info.get(kind) or ():
+                name = name.strip(",")
+                slug = render.slug(name)
+                if not slug:
+                    continue
+                members = index.setdefault((kind, slug), (name, []))[1]
+                if not members or members[-1] != path:
+                    members.append(path)
+    return index
+
+
+def _render_about_me():
+    with profiler.span("render.about_me"):
+        return render.about_me()
+
+
+def _render_search():
+    with profiler.span("render.search_page"):
+        return render.search_page()
+
+
+def _render_css_file(name):
+    with profiler.span("css"):
+        return render.css_files()[name]
+
+
+def _render_post(info):
+    with profiler.span(info["link"].replace(".html", ".md"), "post"):
+        if "post" not in info:
+            info = dict(info, post=post_body(Path(info["source"])))
+        with profiler.span("render.post"):
+            return render.post(info)
+
+
+def _render_fingerprint(minify, critical_css):
+    """a hash of the code and settings rendering depends on"""
+    h = hashlib.sha256(f"{md.__version__}\0{pygments.__version__}\0{md_extensions}"
+                       f"\0{minify}\0{critical_css}".encode())
+    for src in [Path(__file__), *sorted(Path(__file__).parent.glob("lib/*.py"))]:
+        h.update(src.read_bytes())
+    return h.hexdigest()
+
+
+def _render_redirect(link):
+    with profiler.span("render.redirect"):
+        return render.redirect_page(link)
+
+
+def _parse_file(path):
+    """parses a post for post_index, and returns (path, info, stat of
+    the file) and the cache hits and misses it caused, so that they can
+    be merged back from pool workers. The body html is only used for the
+    search terms, the page converts it again (from md_cache) when needed"""
+    before = [(c.hits, c.misses) for c in caches]
+    with profiler.span(str(path), "post"):
+        with profiler.span("read"):
+            st = path.stat()
+            data = path.read_bytes()
+        info = parse_post(data.decode(), path)[path]
+        info["source"] = str(path)
+        info["hash"] = hashlib.sha256(data).hexdigest()
+        with profiler.span("search terms"):
+            info["terms"] = search.post_terms(info)
+        del info["post"]
+    return (path, info, st), [(c.hits - hits, c.misses - misses)
+                              for c, (hits, misses) in zip(caches, before)]
 
 
 def parse_post(s: str, path):
-    lines = s.splitlines()
+    with profiler.span("front matter"):
+        lines = s.splitlines()
+        header_start, header_end = _header_bounds(lines)
+        result = parse_header([l.strip() for l in lines[header_start + 1: header_end]])
+
+    if result['excerpt_sep'] is not None:
+        print(path)
+        excerpt_end = lines.index(result['excerpt_sep'])
+        excerpt_md = "\n".join(l for l in lines[header_end + 1: excerpt_end]
+                if not l.strip().startswith('#'))
+        result['excerpt'] = md_2_html(excerpt_md)
+
+    result['post'] = md_2_html('\n'.join(lines[header_end + 1:]))
+    result['dt'] = dt.datetime.strptime(path.name[:10], "%Y-%m-%d")
+    result['link'] = str(path.with_suffix(".html"))
+    result['date'] = result['dt'].date()
+    return {path: result}
+
+
+def post_body(path):
+    """the html of the body of the post at path"""
+    lines = path.read_text().splitlines()
+    return md_2_html('\n'.join(lines[_header_bounds(lines)[1] + 1:]))
+
+
+def _header_bounds(lines):
     stripped_lines = list(map(str.strip, lines))
     header_start = stripped_lines.index("---")
-    header_end = stripped_lines.index("---", header_start + 1)
-    header = stripped_lines[header_start + 1: header_end]
+    return header_start, stripped_lines.index("---", header_start + 1)
+
 
+def parse_header(header):
     keys = "title excerpt_sep excerpt categories tags".split()
     result = {k: None for k in keys}
     for line in header:
@@ -105,23 +815,12 @@ def parse_post(s: str, path):
                 result["tags"] = t.split()
             case ["permalink", link]:
                 result['extralink'] = link
-
-    if result['excerpt_sep'] is not None:
-        print(path)
-        excerpt_end = lines.index(result['excerpt_sep'])
-        excerpt_md = "\n".join(l for l in lines[header_end + 1: excerpt_end]
-                if not l.strip().startswith('#'))
-        result['excerpt'] = md_2_html(excerpt_md)
-
-    result['post'] = md_2_html('\n'.join(lines[header_end + 1:]))
-    result['dt'] = dt.datetime.strptime(path.name[:10], "%Y-%m-%d")
-    result['link'] = str(path.with_suffix(".html"))
-    result['date'] = result['dt'].date()
-    return {path: result}
+    return result
 
 
 def md_2_html(s):
-    return md.markdown(s, extensions=["extra", "codehilite", "mdx_math"])
+    with profiler.span("md_2_html"):
+        return md_cache.get_or_make(lambda: markup.convert(s), s)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+"""
+Incremental copying of static files into the dist dir. A manifest records
+size, mtime and hash of every copied source, so unchanged files are neither
+read nor written again, and their mtimes in the dist dir stay stable.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+from .cache import file_hash, manifest_path
+
+
+class AssetSync:
+    def __init__(self, dist_dir, cache_dir=".cache/assets"):
+        self.dist_dir = Path(dist_dir)
+        self.manifest_path = manifest_path(cache_dir, self.dist_dir)
+        try:
+            self.manifest = json.loads(self.manifest_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+        self.copied = 0
+        self.skipped = 0
+
+    def sync(self, src, output):
+        """copies src to output (relative to dist_dir) unless the target is
+        already up to date. Returns whether something was copied"""
+        src = Path(src)
+        target = self.dist_dir / output
+        st = src.stat()
+        entry = self.manifest.get(output)
+        if entry is not None and entry["src"] == str(src) and _intact(target, entry):
+            if (entry["size"], entry["mtime"]) == (st.st_size, st.st_mtime_ns):
+                self.skipped += 1
+                return False
+            digest = file_hash(src)
+            if digest == entry["hash"]:
+                # only touched, keep the target as it is
+                entry.update(size=st.st_size, mtime=st.st_mtime_ns)
+                self.skipped += 1
+                return False
+        else:
+            digest = file_hash(src)
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _copy(src, target)
+        tst = target.stat()
+        self.manifest[output] = dict(src=str(src), size=st.st_size, mtime=st.st_mtime_ns,
+                                     hash=digest, target=[tst.st_size, tst.st_mtime_ns])
+        self.copied += 1
+        return True
+
+    def delete(self, output):
+        self.manifest.pop(output, None)
+        self.dist_dir.joinpath(output).unlink(missing_ok=True)
+
+    def prune(self, outputs):
+        """deletes all outputs of earlier runs that are not in outputs
+        anymore, because their source is gone"""
+        for output in set(self.manifest) - set(outputs):
+            print(f"removing {output}")
+            self.delete(output)
+
+    def save(self):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest))
+        os.replace(tmp, self.manifest_path)
+
+    def stats(self):
+        return f"assets: {self.copied} copied, {self.skipped} unchanged"
+
+
+def _intact(target, entry):
+    try:
+        st = target.stat()
+    except FileNotFoundError:
+        return False
+    return [st.st_size, st.st_mtime_ns] == entry["target"]
+
+
+def _copy(src, target):
+    """Copies src to target via a temporary file, so a target that is a
+    hardlink to an older version of src is never written through. Tries a
+    hardlink first, then copy_file_range (which reflinks on filesystems that
+    support it), and then a plain copy. The mtime of src is kept."""
+    tmp = target.with_name(f".{target.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        if os.path.samestat(os.stat(src), os.stat(target)):
+            # already a hardlink of src. Replacing it with another one would
+            # do nothing, and leave tmp behind
+            return
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            _copy_file_range(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        shutil.copystat(src, tmp)
+    os.replace(tmp, target)
+
+
+def _copy_file_range(src, target):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("copy_file_range is not available")
+    with open(src, "rb") as fin, open(target, "wb") as fout:
+        remaining = os.fstat(fin.fileno()).st_size
+        while remaining > 0:
+            n = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+            if n == 0:
+                break
+            remaining -= n
@@ -0,0 +1,98 @@
+"""
+A small content addressed cache on disk. Entries are stored as one file per
+key, named after the sha256 of the key parts. The mtime of an entry is its
+last use, which is what the gc uses to evict old entries.
+
+file_hash() and manifest_path() are shared by everything else that keeps
+state about files on disk.
+"""
+import hashlib
+import os
+import time
+from pathlib import Path
+
+
+class Cache:
+    def __init__(self, root, *salt, enabled=True, max_age_days=30):
+        self.root = Path(root)
+        self.salt = "\0".join(map(str, salt))
+        self.enabled = enabled
+        self.max_age = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts):
+        h = hashlib.sha256(self.salt.encode())
+        for part in parts:
+            h.update(b"\0")
+            h.update(part.encode() if isinstance(part, str) else part)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.root / key[:2] / key[2:]
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, key, data: bytes):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def get_or_make(self, make, *parts):
+        """returns the cached string for parts, or calls make() and stores its
+        result"""
+        key = self.key(*parts)
+        data = self.get(key)
+        if data is not None:
+            self.hits += 1
+            return data.decode()
+        self.misses += 1
+        res = make()
+        self.put(key, res.encode())
+        return res
+
+    def gc(self):
+        """removes all entries that were not used within max_age. Returns the
+        number of removed entries"""
+        if not self.root.exists():
+            return 0
+        deadline = time.time() - self.max_age
+        removed = 0
+        for path in self.root.glob("*/*"):
+            if path.stat().st_mtime < deadline:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def stats(self):
+        return f"{self.root}: {self.hits} hits, {self.misses} misses"
+
+
+def file_hash(path, *salt):
+    """the sha256 of the salt parts and the content of path, as hex"""
+    h = hashlib.sha256()
+    for part in salt:
+        h.update(f"{part}\0".encode())
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_path(cache_dir, dist_dir):
+    """the file in cache_dir that keeps the state of dist_dir"""
+    key = hashlib.sha256(str(Path(dist_dir).resolve()).encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{key}.json"
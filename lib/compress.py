@@ -0,0 +1,118 @@
+"""
+Precompressed .gz (and .zst, if a zstd module is available) sidecars for the
+text outputs of a build, so the web server can send them as they are. Files
+are only recompressed when their content changed since the last build.
+"""
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import cache
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+suffixes = (".html", ".css", ".js", ".svg", ".json", ".xml", ".txt")
+# of all encoders, available or not
+sidecar_suffixes = (".gz", ".zst")
+min_size = 256
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _zstd(data):
+    if hasattr(zstd, "ZstdCompressor"):
+        return zstd.ZstdCompressor(level=19).compress(data)
+    return zstd.compress(data, level=19)
+
+
+encoders = {".gz": _gzip}
+if zstd is not None:
+    encoders[".zst"] = _zstd
+
+
+def precompress(dist_dir, outputs, cache_dir=".cache/compress", threads=None):
+    """writes sidecars next to every compressible output in dist_dir, and
+    removes sidecars whose output is gone. Returns (original size, size of
+    the gzip sidecars) over all compressible outputs"""
+    dist_dir = Path(dist_dir)
+    manifest_path = cache.manifest_path(cache_dir, dist_dir)
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    outputs = sorted(o for o in outputs if o.endswith(suffixes))
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda o: _compress(dist_dir, o, manifest.get(o)), outputs))
+
+    new_manifest = {}
+    raw_total = gz_total = compressed = 0
+    for output, (entry, did_compress) in zip(outputs, results):
+        if entry is None:
+            continue
+        new_manifest[output] = entry
+        raw_total += entry["size"]
+        gz_total += entry.get(".gz", entry["size"])
+        compressed += did_compress
+
+    for output in set(manifest) - set(new_manifest):
+        remove_sidecars(dist_dir / output)
+
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps(new_manifest))
+    saved = raw_total - gz_total
+    print(f"compressed {compressed} of {len(new_manifest)} files, gzip saves "
+          f"{saved / 1024:.1f} KiB of {raw_total / 1024:.1f} KiB "
+          f"({saved / max(raw_total, 1):.0%})")
+    return raw_total, gz_total
+
+
+def _compress(dist_dir, output, entry):
+    """returns the manifest entry for output, and whether it was compressed
+    again. The entry is None if output is missing or too small"""
+    path = dist_dir / output
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None, False
+    if len(data) < min_size:
+        remove_sidecars(path)
+        return None, False
+    digest = hashlib.sha256(data).hexdigest()
+    if (entry is not None and entry["hash"] == digest and entry["encoders"] == list(encoders)
+            and all(_sidecar(path, s).exists() for s in encoders if s in entry)):
+        return entry, False
+
+    entry = {"hash": digest, "size": len(data), "encoders": list(encoders)}
+    for suffix, encode in encoders.items():
+        sidecar = _sidecar(path, suffix)
+        packed = encode(data)
+        if len(packed) >= len(data):
+            sidecar.unlink(missing_ok=True)
+            continue
+        tmp = sidecar.with_name(f".{sidecar.name}.tmp")
+        tmp.write_bytes(packed)
+        os.replace(tmp, sidecar)
+        entry[suffix] = len(packed)
+    return entry, True
+
+
+def _sidecar(path, suffix):
+    return path.with_name(path.name + suffix)
+
+
+def remove_sidecars(path):
+    """removes the sidecars of path, which are outdated once it changed"""
+    for suffix in sidecar_suffixes:
+        _sidecar(path, suffix).unlink(missing_ok=True)
@@ -0,0 +1,173 @@
+"""
+Critical CSS. inline() puts the rules of the local stylesheets of a page
+that may match something above the fold into a <style> in the <head>, so
+the first screen renders without waiting for another request. The links
+to the stylesheets stay where they are, but are preloaded and only applied
+when they arrived, so they do not block rendering. Browsers without
+scripts apply them from a <noscript> fallback. The stylesheets contain the
+inlined rules again, in the same order and after them, so the cascade is
+the same as with the plain links, also for <style> elements in posts. The
+stylesheets themselves are the fingerprinted copies, which browsers keep.
+
+A rule may match above the fold if every tag, class and id in one of its
+selectors occurs before fold_chars of text. This never drops a rule that
+matches there, but may keep some that do not.
+"""
+import re
+from html.parser import HTMLParser
+
+# about the text on the first screen of a phone
+fold_chars = 1000
+grouping_rules = ("@media", "@supports", "@layer", "@container")
+
+_link_re = re.compile(r'<link\b[^>]*\brel="stylesheet"[^>]*>')
+_href_re = re.compile(r'\bhref="([^"]*)"')
+_comment_re = re.compile(r"/\*.*?\*/", re.S)
+_args_re = re.compile(r"\([^()]*\)")
+# what a selector can contain besides tags, classes and ids
+_ignored_re = re.compile(r"\[[^\]]*\]|::?[-\w]+")
+_token_re = re.compile(r"[.#]?-?[_a-zA-Z][-\w]*")
+_preload = 'rel="preload" as="style" onload="this.onload=null;this.rel=\'stylesheet\'"'
+
+
+def inline(html, stylesheets):
+    """stylesheets maps the urls of local stylesheets to their css. Returns
+    html with the rules of them it needs first inlined, and its links to them
+    deferred, see above"""
+    links = [m for m in _link_re.finditer(html) if _href(m.group(0)) in stylesheets]
+    if not links:
+        return html
+    page = _PageTokens()
+    page.feed(html)
+    page.close()
+    rules = [rule for m in links for rule in parse(stylesheets[_href(m.group(0))])]
+    above = select(rules, page.above_fold)
+
+    parts = []
+    pos = 0
+    for i, m in enumerate(links):
+        parts.append(html[pos:m.start()])
+        if i == 0:
+            parts.append(f"<style>{render(above)}</style>")
+        parts.append(_deferred(m.group(0)))
+        pos = m.end()
+    return "".join(parts) + html[pos:]
+
+
+def _deferred(link):
+    preload = link.replace('rel="stylesheet"', _preload, 1)
+    return f"{preload}<noscript>{link}</noscript>"
+
+
+def parse(css):
+    """splits css into a list of rules, which are (prelude, content) pairs.
+    content is the declarations as str, a list of rules for grouping rules
+    like @media, or None for statements like @import"""
+    return _parse(_comment_re.sub("", css), 0)[0]
+
+
+def _parse(css, i):
+    rules = []
+    while True:
+        j = _find(css, i, "{};")
+        if j == len(css) or css[j] == "}":
+            return rules, j + 1
+        prelude = css[i:j].strip()
+        if css[j] == ";":
+            if prelude:
+                rules.append((prelude, None))
+            i = j + 1
+        elif prelude.startswith(grouping_rules):
+            inner, i = _parse(css, j + 1)
+            rules.append((prelude, inner))
+        else:
+            # a style rule, or a block like @font-face or @keyframes
+            end = _block_end(css, j + 1)
+            # css strings cannot contain newlines, so this keeps them intact
+            rules.append((prelude, re.sub(r"\s*\n\s*", " ", css[j + 1:end].strip())))
+            i = end + 1
+
+
+def _find(css, i, chars):
+    while i < len(css) and css[i] not in chars:
+        i += 1
+    return i
+
+
+def _block_end(css, i):
+    depth = 1
+    while i < len(css):
+        if css[i] == "{":
+            depth += 1
+        elif css[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return i
+
+
+def render(rules):
+    lines = []
+    for prelude, content in rules:
+        if content is None:
+            lines.append(f"{prelude};")
+        elif isinstance(content, list):
+            lines.append(f"{prelude} {{\n{render(content)}\n}}")
+        else:
+            lines.append(f"{prelude} {{ {content} }}")
+    return "\n".join(lines)
+
+
+def select(rules, tokens):
+    """the rules that may match an element on a page with tokens. At-rules
+    other than grouping rules are always kept"""
+    res = []
+    for prelude, content in rules:
+        if isinstance(content, list):
+            inner = select(content, tokens)
+            if inner:
+                res.append((prelude, inner))
+        elif prelude.startswith("@") or _may_match(prelude, tokens):
+            res.append((prelude, content))
+    return res
+
+
+def _may_match(selectors, tokens):
+    # arguments of pseudo classes like :not() only ever narrow a selector
+    prev = None
+    while prev != selectors:
+        prev, selectors = selectors, _args_re.sub("", selectors)
+    selectors = _ignored_re.sub(" ", selectors).lower()
+    return any(set(_token_re.findall(sel)) <= tokens for sel in selectors.split(","))
+
+
+def _href(link):
+    m = _href_re.search(link)
+    return m.group(1) if m else None
+
+
+class _PageTokens(HTMLParser):
+    """collects the tags, classes (as .name) and ids (as #name) of a page
+    that start before fold_chars of text in the body in above_fold"""
+    def __init__(self):
+        super().__init__()
+        self.above_fold = set()
+        self._in_body = False
+        self._text = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        tokens = {tag, *("." + c.lower() for c in (attrs.get("class") or "").split())}
+        if attrs.get("id"):
+            tokens.add("#" + attrs["id"].lower())
+        if self._text < fold_chars:
+            self.above_fold |= tokens
+        if tag == "body":
+            self._in_body = True
+
+    handle_startendtag = handle_starttag
+
+    def handle_data(self, data):
+        if self._in_body:
+            self._text += len(data.strip())
@@ -1,7 +1,6 @@
 """
 This is coppied from https://raw.githubusercontent.com/slacy/pyssed/master/pyssed/__init__.py
 """
-import copy
 
 
 class style(object):
@@ -22,32 +21,37 @@ class style(object):
 
     def append(self, other):
         """Append syle 'other' to self."""
-        self._styles = self.__add__(other)._styles
-
-    def __add__(self, other):
-        """Add self and other, and return a new style instance."""
-        summed = copy.deepcopy(self)
         if isinstance(other, str):
             single = other.split(':')
-            summed._styles[single[0]] = single[1]
+            self._styles[single[0]] = single[1]
         elif isinstance(other, dict):
-            summed._styles.update(other)
+            self._styles.update(other)
         elif isinstance(other, style):
-            summed._styles.update(other._styles)
+            self._styles.update(other._styles)
         else:
             raise 'Bad type for style'
+
+    def __add__(self, other):
+        """Add self and other, and return a new style instance. Only the top
+        level dict is copied, nested styles are shared with self and other,
+        and must not be modified in place."""
+        summed = style()
+        summed._styles = dict(self._styles)
+        summed.append(other)
         return summed
 
     def __repr__(self):
         return str(self._styles)
 
 
-def generate(css, parent='', indent=4):
+def generate(css, parent='', indent=4, result=None):
     """Given a dict mapping CSS selectors to a dict of styles, generate a
-    list of lines of CSS output."""
+    list of lines of CSS output. If result is given, the lines are appended
+    to it."""
     subnodes = []
     stylenodes = []
-    result = []
+    if result is None:
+        result = []
 
     for name, value in css.items():
         # If the sub node is a sub-style...
@@ -79,10 +83,27 @@ def generate(css, parent='', indent=4):
         result.append('') # a newline
 
     for subnode in subnodes:
-        result += generate(subnode[1],
-                           parent=(parent.strip() + ' ' + subnode[0]).strip())
+        generate(subnode[1],
+                 parent=(parent.strip() + ' ' + subnode[0]).strip(),
+                 indent=indent, result=result)
 
     return result
 
+
+_rendered = {}
+
 def render(css):
-    return '\n'.join(generate(css))
+    """generate() joined to a string. The result is memoized on the content
+    of css, so rendering an unchanged stylesheet again is only a lookup."""
+    key = _freeze(css)
+    if key not in _rendered:
+        if len(_rendered) > 64:
+            _rendered.clear()
+        _rendered[key] = '\n'.join(generate(css))
+    return _rendered[key]
+
+
+def _freeze(css):
+    return tuple((name, _freeze(value)) if isinstance(value, (dict, style))
+                 else (name, type(value).__name__, value)
+                 for name, value in css.items())
@@ -0,0 +1,138 @@
+"""
+A build daemon and its client. `blog.py daemon` keeps the imports, warm
+converters, the post index and the sites of earlier builds in memory, and
+listens on a Unix socket. blog.py hands build commands to it before
+importing anything heavy, and builds in process if no daemon runs.
+
+Each connection carries one request, {"argv": [...]}, which is answered
+with JSON lines: {"out": text} for output, and finally {"exit": code,
+"first_output": time}. If the code of the daemon changed since it started,
+it answers {"exit": 0, "restart": true} instead and quits, and the client
+builds in process.
+
+This module only imports the standard library, to keep the client fast.
+"""
+import contextlib
+import json
+import socket
+import sys
+import time
+import traceback
+from pathlib import Path
+
+socket_path = Path(".cache/daemon.sock")
+# publish runs ssh and rsync, which need the terminal and environment of the
+# client, and gains nothing from warm state
+commands = ("build",)
+
+
+def run_client(argv, started):
+    """runs argv in the daemon and exits with its exit code. Returns if no
+    daemon runs, or if argv has to run in process"""
+    if not argv or argv[0] not in commands or "--no-daemon" in argv or "--profile" in argv:
+        return
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return
+    with sock, sock.makefile("rb") as answers:
+        sock.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        for line in answers:
+            msg = json.loads(line)
+            if "out" in msg:
+                sys.stdout.write(msg["out"])
+                sys.stdout.flush()
+            elif msg.get("restart"):
+                print("the build daemon is outdated and stopped, building in process")
+                return
+            else:
+                if argv[0] == "build" and msg["exit"] == 0:
+                    report_times(started, msg["first_output"])
+                sys.exit(msg["exit"])
+    print("lost the build daemon, building in process")
+
+
+def report_times(started, first_output):
+    done = (time.time() - started) * 1000
+    if first_output is None:
+        print(f"no outputs changed, done after {done:.0f} ms")
+    else:
+        print(f"first output after {(first_output - started) * 1000:.0f} ms, "
+              f"done after {done:.0f} ms")
+
+
+def serve_forever(handle, is_current):
+    """answers requests until the daemon is outdated. handle(argv) runs a
+    command, and returns the time of its first output or None. Everything
+    it prints goes to the client. is_current() tells whether the code of
+    the daemon is unchanged"""
+    probe = socket.socket(socket.AF_UNIX)
+    with probe:
+        if probe.connect_ex(str(socket_path)) == 0:
+            raise SystemExit(f"a build daemon is already listening on {socket_path}")
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    socket_path.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(str(socket_path))
+    server.listen()
+    print(f"build daemon listening on {socket_path}")
+    try:
+        with server:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    if not _answer(conn, handle, is_current):
+                        break
+    finally:
+        socket_path.unlink(missing_ok=True)
+    print("the code changed, stopping the build daemon")
+
+
+def _answer(conn, handle, is_current):
+    """answers one request. Returns False if the daemon should stop"""
+    with conn.makefile("rb") as requests:
+        request = json.loads(requests.readline() or "{}")
+    out = _Output(conn)
+    if "argv" not in request:
+        return True
+    if not is_current():
+        out.send(exit=0, restart=True)
+        return False
+    code, first_output = 0, None
+    print("running", *request["argv"])
+    with contextlib.redirect_stdout(out):
+        try:
+            first_output = handle(request["argv"])
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                print(e.code)
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            code = 1
+    out.send(exit=code, first_output=first_output)
+    return True
+
+
+class _Output:
+    """a stdout replacement that sends everything to the client. If the
+    client went away, the output is dropped and the command goes on"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, text):
+        self.send(out=text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def send(self, **msg):
+        if self.conn is None:
+            return
+        try:
+            self.conn.sendall(json.dumps(msg).encode() + b"\n")
+        except OSError:
+            self.conn = None
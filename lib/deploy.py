@@ -0,0 +1,246 @@
+"""
+Write-if-changed outputs and incremental publishing. OutputManifest records
+hash and size of every output in the dist dir, in dist_dir/.manifest.json,
+and only writes an output if its content changed, so the mtimes of
+unchanged files stay stable. The compressed sidecars of changed or deleted
+outputs are removed, until compress.precompress writes them again.
+
+publish() compares that manifest with the one of the last publish at the
+target, transfers only added or changed files, deletes removed ones, and
+then stores the new manifest at the target. Targets are local directories,
+or host:path, which is reached with rsync and ssh.
+"""
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess as sp
+from pathlib import Path, PurePosixPath
+
+from .cache import file_hash
+from .compress import remove_sidecars
+
+manifest_name = ".manifest.json"
+
+
+class OutputManifest:
+    def __init__(self, dist_dir):
+        self.dist_dir = Path(dist_dir)
+        self.path = self.dist_dir / manifest_name
+        self.entries = _load(self.path)
+        self.written = 0
+        self.unchanged = 0
+
+    def write_text(self, output, content, key=None):
+        """writes content to output (relative to dist_dir), unless the file
+        already has it. key identifies the inputs content was rendered from,
+        see fresh(). Returns whether the file was written"""
+        data = content.encode()
+        entry = [hashlib.sha256(data).hexdigest(), len(data)]
+        target = self.dist_dir / output
+        if self.entries.get(output, [])[:2] == entry and _size(target) == entry[1]:
+            self.entries[output] = entry + ([key] if key else [])
+            self.unchanged += 1
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, target)
+        remove_sidecars(target)
+        self.entries[output] = entry + ([key] if key else [])
+        self.written += 1
+        return True
+
+    def fresh(self, output, key):
+        """whether output was written from inputs with the given key, and is
+        still intact, so it does not need to be rendered again"""
+        entry = self.entries.get(output)
+        return (entry is not None and entry[2:] == [key]
+                and _size(self.dist_dir / output) == entry[1])
+
+    def intact(self):
+        """whether every output is still in dist_dir, with its size"""
+        return all(_size(self.dist_dir / output) == entry[1]
+                   for output, entry in self.entries.items())
+
+    def record(self, output, digest, size):
+        """adds an output that was written by someone else"""
+        if self.entries.get(output, [])[:2] != [digest, size]:
+            remove_sidecars(self.dist_dir / output)
+        self.entries[output] = [digest, size]
+
+    def delete(self, output):
+        self.entries.pop(output, None)
+        self.dist_dir.joinpath(output).unlink(missing_ok=True)
+        remove_sidecars(self.dist_dir / output)
+
+    def prune(self, outputs):
+        """deletes all outputs of earlier runs that are not in outputs
+        anymore"""
+        for output in self.entries.keys() - set(outputs):
+            print(f"removing {output}")
+            self.delete(output)
+
+    def save(self):
+        _store(self.path, json.dumps(self.entries, sort_keys=True))
+
+    def stats(self):
+        return f"outputs: {self.written} written, {self.unchanged} unchanged"
+
+
+def publish(dist_dir, target, dry_run=False):
+    """makes target a copy of dist_dir, transferring only what changed since
+    the last publish. Returns the lists of transferred and deleted files"""
+    dist_dir = Path(dist_dir)
+    if not (dist_dir / manifest_name).exists():
+        raise SystemExit(f"{dist_dir} has no {manifest_name}, build it first")
+    target = LocalTarget(target) if _is_local(target) else SshTarget(target)
+    local = dist_manifest(dist_dir)
+    remote = target.read_manifest()
+    if not remote:
+        # without a manifest the target may contain anything, like the
+        # files of a publish with rsync, so it is compared by its files
+        remote = {f: None for f in target.files() if f != manifest_name}
+    changed = sorted(p for p, entry in local.items() if remote.get(p) != entry)
+    removed = sorted(remote.keys() - local.keys())
+    print(f"publishing to {target}: {len(changed)} changed, {len(removed)} removed, "
+          f"{len(local) - len(changed)} unchanged")
+    if dry_run:
+        for path in changed + [f"removing {p}" for p in removed]:
+            print("   ", path)
+    else:
+        target.put(dist_dir, changed)
+        target.delete(removed)
+        target.write_manifest(json.dumps(local, sort_keys=True))
+    return changed, removed
+
+
+def dist_manifest(dist_dir):
+    """the manifest of dist_dir, for all files in it. Files the build did
+    not record, like the sidecars of compress, are hashed"""
+    recorded = _load(dist_dir / manifest_name)
+    res = {}
+    for root, _, files in os.walk(dist_dir):
+        for name in files:
+            path = Path(root, name)
+            output = path.relative_to(dist_dir).as_posix()
+            if output == manifest_name or name.endswith(".tmp"):
+                continue
+            entry = recorded.get(output)
+            res[output] = entry[:2] if entry is not None else [file_hash(path), path.stat().st_size]
+    return res
+
+
+class LocalTarget:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def read_manifest(self):
+        return _load(self.path / manifest_name)
+
+    def files(self):
+        return [Path(root, name).relative_to(self.path).as_posix()
+                for root, _, names in os.walk(self.path) for name in names]
+
+    def put(self, dist_dir, files):
+        for f in files:
+            target = self.path / f
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f".{target.name}.tmp")
+            shutil.copy2(dist_dir / f, tmp)
+            os.replace(tmp, target)
+
+    def delete(self, files):
+        for f in files:
+            target = self.path / f
+            target.unlink(missing_ok=True)
+            # remove directories that became empty, like the page of a
+            # tag that is not used anymore
+            for parent in target.parents:
+                if parent == self.path:
+                    break
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+
+    def write_manifest(self, text):
+        self.path.mkdir(parents=True, exist_ok=True)
+        _store(self.path / manifest_name, text)
+
+
+class SshTarget:
+    def __init__(self, target):
+        self.host, _, self.path = target.partition(":")
+        self.path = self.path.rstrip("/") or "."
+
+    def __str__(self):
+        return f"{self.host}:{self.path}"
+
+    def _ssh(self, cmd, **kwargs):
+        return sp.run(["ssh", self.host, f"cd {shlex.quote(self.path)} && {cmd}"],
+                      text=True, **kwargs)
+
+    def read_manifest(self):
+        res = self._ssh(f"cat {manifest_name}", capture_output=True)
+        if res.returncode != 0:
+            return {}
+        try:
+            return json.loads(res.stdout)
+        except json.JSONDecodeError:
+            return {}
+
+    def files(self):
+        res = self._ssh("find . ! -type d -print0", capture_output=True)
+        if res.returncode != 0:
+            return []
+        return [f.removeprefix("./") for f in res.stdout.split("\0") if f]
+
+    def put(self, dist_dir, files):
+        if files:
+            sp.run(["rsync", "-az", "--files-from=-", f"{dist_dir}/", f"{self}/"],
+                   input="\n".join(files), text=True, check=True)
+
+    def delete(self, files):
+        if not files:
+            return
+        self._ssh("xargs -0 rm -f --", input="\0".join(files), check=True)
+        # like LocalTarget, removes directories that became empty. rmdir
+        # fails for the others, deeper ones come first
+        dirs = {str(d) for f in files for d in PurePosixPath(f).parents if str(d) != "."}
+        self._ssh("xargs -0 rmdir -- 2>/dev/null; true",
+                  input="\0".join(sorted(dirs, key=lambda d: -d.count("/"))), check=True)
+
+    def write_manifest(self, text):
+        self._ssh(f"cat > {manifest_name}.tmp && mv {manifest_name}.tmp {manifest_name}",
+                  input=text, check=True)
+
+
+def _is_local(target):
+    # like rsync: a colon before the first slash means host:path
+    head = target.split("/", 1)[0]
+    return ":" not in head or Path(target).exists()
+
+
+def _load(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _store(path, text):
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def _size(path):
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
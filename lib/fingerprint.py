@@ -0,0 +1,81 @@
+"""
+Content-fingerprinted asset URLs. Stylesheets, scripts and images get a
+copy whose name contains a hash of their content, like
+common.3f2a9c1b0d.css, and the references of <link>, <script>, <img> and
+<source> tags in html are rewritten to those copies. As the content behind
+such a URL never changes, browsers can keep it forever, without asking
+again. The header rules that allow them to are rendered by headers(), in
+the _headers format of static hosts like Netlify or Cloudflare Pages.
+
+The plain names are still written, for links from elsewhere.
+"""
+import hashlib
+import re
+from pathlib import PurePosixPath
+
+suffixes = (".css", ".js", ".png", ".jpg", ".jpeg", ".webp", ".gif", ".svg")
+headers_output = "_headers"
+cache_control = "public, max-age=31536000, immutable"
+
+_tag_re = re.compile(r"<(?:link|script|img|source)\b[^>]*>")
+_attr_re = re.compile(r'\b(href|src|srcset)="([^"]*)"')
+
+
+def handles(output):
+    return output.lower().endswith(suffixes)
+
+
+class Fingerprints:
+    """maps outputs to their fingerprinted copies"""
+
+    def __init__(self):
+        self.copies = {}
+        self._urls = {}
+
+    def set(self, output, digest):
+        """sets the digest of the content of output. Returns the old and
+        the new copy, or None if the copy did not change"""
+        p = PurePosixPath(output)
+        copy = str(p.with_name(f"{p.stem}.{digest[:10]}{p.suffix}"))
+        old = self.copies.get(output)
+        if old == copy:
+            return None
+        self.copies[output] = copy
+        self._urls["/" + output] = "/" + copy
+        return old, copy
+
+    def remove(self, output):
+        """returns the copy of output, which is gone now, or None"""
+        self._urls.pop("/" + output, None)
+        return self.copies.pop(output, None)
+
+    def key(self):
+        """identifies the current copies, for everything that references
+        them"""
+        return hashlib.sha256(
+            "\0".join(f"{o}\0{c}" for o, c in sorted(self.copies.items())).encode()).hexdigest()
+
+    def rewrite(self, html):
+        return _tag_re.sub(lambda m: _attr_re.sub(self._rewrite_attr, m.group(0)), html)
+
+    def _rewrite_attr(self, match):
+        name, value = match.groups()
+        if name == "srcset":
+            # a list of "url descriptor" entries
+            value = ", ".join(" ".join([self._urls.get(url, url), *rest])
+                              for url, *rest in (e.split() for e in value.split(",") if e.strip()))
+        else:
+            value = self._urls.get(value, value)
+        return f'{name}="{value}"'
+
+    def headers(self):
+        return "".join(f"/{copy}\n  Cache-Control: {cache_control}\n"
+                       for copy in sorted(self.copies.values()))
+
+
+def digest(data, *salt):
+    h = hashlib.sha256()
+    for part in salt:
+        h.update(f"{part}\0".encode())
+    h.update(data)
+    return h.hexdigest()
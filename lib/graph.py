@@ -0,0 +1,70 @@
+"""
+A minimal build graph. Every output has a rule, which renders it, and a set
+of named inputs it depends on. Touching an input marks all outputs that
+depend on it as stale, and build() regenerates only the stale ones.
+"""
+from collections import defaultdict
+
+
+class Graph:
+    def __init__(self):
+        self.rules = {}
+        self.inputs = {}
+        self.dependents = defaultdict(set)
+        self.stale = set()
+        self.removed = set()
+
+    def add(self, output, rule, inputs, stale=True):
+        """adds or replaces the rule for output. A rule is a callable without
+        arguments, that returns the content as str, or a Path to a file that
+        should be copied. The output is marked as stale, unless the caller
+        knows that it is up to date."""
+        for inp in self.inputs.get(output, ()):
+            self.dependents[inp].discard(output)
+        self.rules[output] = rule
+        self.inputs[output] = set(inputs)
+        for inp in inputs:
+            self.dependents[inp].add(output)
+        if stale:
+            self.stale.add(output)
+        else:
+            self.stale.discard(output)
+        self.removed.discard(output)
+
+    def remove(self, output):
+        if output not in self.rules:
+            return
+        for inp in self.inputs.pop(output):
+            self.dependents[inp].discard(output)
+        del self.rules[output]
+        self.stale.discard(output)
+        self.removed.add(output)
+
+    def touch(self, *inputs):
+        for inp in inputs:
+            self.stale |= self.dependents.get(inp, set())
+
+    def build(self, write, delete, mapper=map, defer=None):
+        """runs the rules of all stale outputs through mapper, passes the
+        results to write(output, content), and calls delete(output) for
+        removed outputs. If defer is given, it is called as defer(output,
+        rule) first, and if that returns True, it took care of the output and
+        the rule is not run. Returns the list of stale outputs.
+        If mapper raises, the outputs stay stale, and the next build renders
+        them again."""
+        outputs = sorted(self.stale)
+        if defer is not None:
+            run = [o for o in outputs if not defer(o, self.rules[o])]
+        else:
+            run = outputs
+        for output, content in zip(run, mapper(_run, [self.rules[o] for o in run])):
+            write(output, content)
+        for output in sorted(self.removed):
+            delete(output)
+        self.stale.clear()
+        self.removed.clear()
+        return outputs
+
+
+def _run(rule):
+    return rule()
@@ -0,0 +1,40 @@
+"""
+Memoized syntax highlighting for the codehilite extension. Highlighted code
+blocks are stored in a Cache, keyed by everything that determines the
+output: the code, its language and the formatter options. So when only the
+prose of a post changes, its code blocks are not highlighted again. Lexers
+are also created only once per name and options, instead of once per block.
+
+Both codehilite and fenced_code use codehilite.CodeHilite, so install()
+replaces its hilite method.
+"""
+from functools import wraps
+
+from markdown.extensions import codehilite
+from pygments.lexers import get_lexer_by_name
+
+_lexers = {}
+
+
+def install(cache):
+    hilite = getattr(codehilite.CodeHilite.hilite, "__wrapped__", codehilite.CodeHilite.hilite)
+
+    @wraps(hilite)
+    def cached_hilite(self, shebang=True):
+        # all attributes of the instance are inputs of hilite, src is one
+        # of them
+        key = repr((sorted(vars(self).items()), shebang))
+        return cache.get_or_make(lambda: hilite(self, shebang), key)
+
+    codehilite.CodeHilite.hilite = cached_hilite
+    codehilite.get_lexer_by_name = _shared_lexer
+
+
+def _shared_lexer(name, **options):
+    """get_lexer_by_name, but lexers are reused. Lexers do not keep state
+    between calls to get_tokens, so this is safe"""
+    key = (name, repr(sorted(options.items())))
+    lexer = _lexers.get(key)
+    if lexer is None:
+        lexer = _lexers[key] = get_lexer_by_name(name, **options)
+    return lexer
@@ -7,11 +7,26 @@ class hBase(type):
         return cls(name)
 
 
-class h(metaclass=hBase):
+class _Frozen:
+    """Elements are immutable, [] and () return new elements. This allows to
+    share subtrees between pages."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _init(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+
+class h(_Frozen, metaclass=hBase):
+    __slots__ = ('_name', '_childs', '_attrs')
+
     def __init__(self, name, childs=None, attrs=None):
-        self._name = name
-        self._childs = childs
-        self._attrs = attrs
+        if childs is not None and not isinstance(childs, str):
+            childs = tuple(childs)
+        self._init(_name=name, _childs=childs, _attrs=attrs)
         
     def __getitem__(self, childs):
         if not hasattr(childs, '__iter__'):
@@ -33,29 +48,30 @@ class h(metaclass=hBase):
         else:
             return ''
         
-    def _format_childs(self):
-        if self._childs is None:
-            return ''
-        if isinstance(self._childs, str):
-            return self._childs
-        else:
-            return '\n'.join(map(str, self._childs))
-        
     def __str__(self):
-        return '<{name}{attrs}>{childs}</{name}>'.format(
-            name=self._name,
-            attrs=self._format_attrs(),
-            childs=self._format_childs())
+        return ''.join(self.chunks())
+
+    def chunks(self):
+        """yields the html of this element in pieces, without building a string
+        for every nested element"""
+        return _chunks(self)
+
+    def render_into(self, write):
+        """writes the html of this element to write, which can e.g. be the
+        write method of a file or a socket"""
+        for chunk in _chunks(self):
+            write(chunk)
             
     def __repr__(self):
         return str(self)
 
     
-class s(metaclass=hBase):
+class s(_Frozen, metaclass=hBase):
     """the same as h, but for self closing elements, this was not in the source"""
+    __slots__ = ('_name', '_attrs')
+
     def __init__(self, name, attrs=None):
-        self._name = name
-        self._attrs = attrs
+        self._init(_name=name, _attrs=attrs)
         
     def __call__(self, **attrs):
         return type(self)(self._name, attrs)
@@ -78,6 +94,65 @@ class s(metaclass=hBase):
         return '<{name}{attrs}/>'.format(
             name=self._name,
             attrs=self._format_attrs())
+
+    def chunks(self):
+        yield str(self)
+
+    def render_into(self, write):
+        write(str(self))
             
     def __repr__(self):
         return str(self)
+
+
+class static(_Frozen):
+    """Marks a constant subtree. It is serialized once, when it is created, and
+    the resulting string is reused whenever the subtree is rendered. Several
+    nodes are joined with newlines, like the children of an element, so
+    h.head[static(a, b), c] renders exactly like h.head[a, b, c].
+    Combined with functools.cache on the function building the subtree,
+    the page chrome is only built and formatted once per build."""
+    __slots__ = ('_html',)
+
+    def __init__(self, *nodes):
+        self._init(_html='\n'.join(map(str, nodes)))
+
+    def __str__(self):
+        return self._html
+
+    def chunks(self):
+        yield self._html
+
+    def render_into(self, write):
+        write(self._html)
+
+    def __repr__(self):
+        return self._html
+
+
+def _chunks(node):
+    """Walks the tree below node with an explicit stack, so the cost is linear
+    in the size of the output, independent of the nesting depth. The result
+    is the same as the original recursive formatting: children are joined
+    with newlines, and everything that is not an element is passed to str."""
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+        elif isinstance(item, static):
+            yield item._html
+        elif isinstance(item, h):
+            yield '<{}{}>'.format(item._name, item._format_attrs())
+            stack.append('</{}>'.format(item._name))
+            childs = item._childs
+            if isinstance(childs, str):
+                stack.append(childs)
+            elif childs is not None:
+                childs = list(childs)
+                for i in range(len(childs) - 1, -1, -1):
+                    stack.append(childs[i])
+                    if i:
+                        stack.append('\n')
+        else:
+            yield str(item)
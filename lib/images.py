@@ -0,0 +1,207 @@
+"""
+Responsive images. Raster images below assets get resized variants and WebP
+versions, and <img> tags that reference them are rewritten into <picture>
+elements with srcset, so small screens download small files. SVGs are
+minified. All derivatives are cached in .cache/img by the hash of their
+source, the target width and the format.
+
+Resizing needs Pillow, which is optional. Without it, only SVGs are handled.
+"""
+import hashlib
+import math
+import os
+import re
+from functools import partial
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+widths = (480, 960, 1600)
+raster_suffixes = (".png", ".jpg", ".jpeg")
+# the width of #body_container in common.css
+default_sizes = "(max-width: 50em) 100vw, 50em"
+version = "2"
+
+_img_re = re.compile(r"<img\b[^>]*>")
+_attr_re = re.compile(r'\b(src|srcset|width)="([^"]*)"')
+
+
+class Images:
+    def __init__(self, cache_dir=".cache/img"):
+        self.cache_dir = Path(cache_dir)
+        self._dims = {}
+        if Image is None:
+            print("Pillow is not installed, images will not be resized")
+
+    def handles(self, path):
+        return path.suffix.lower() in raster_suffixes + (".svg",)
+
+    def derived(self, src):
+        """returns a dict mapping the outputs derived from src (a path
+        below assets) to the rules that create them. For an SVG that is
+        the minified file, which replaces the plain copy."""
+        src = Path(src)
+        if src.suffix.lower() == ".svg":
+            return {str(src): partial(optimize_svg, src, self.cache_dir)}
+        if Image is None:
+            return {}
+        return {_variant_output(src, width, fmt): partial(make_variant, src, width, fmt,
+                                                          self.cache_dir)
+                for width, fmt in self._variants(src)}
+
+    def _variants(self, src):
+        dims = self.dimensions(src)
+        if dims is None:
+            return []
+        # resized PNGs often get bigger than the original, because resampling
+        # adds colors, so for them only WebP versions are made
+        full_width = dims[0]
+        formats = ("jpg", "webp") if src.suffix.lower() != ".png" else ("webp",)
+        return [(w, f) for w in widths if w < full_width for f in formats] + [
+            (full_width, "webp")]
+
+    def dimensions(self, src):
+        try:
+            st = src.stat()
+        except FileNotFoundError:
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._dims.get(src)
+        if cached is None or cached[0] != key:
+            try:
+                with Image.open(src) as img:
+                    cached = (key, img.size)
+            except OSError:
+                cached = (key, None)
+            self._dims[src] = cached
+        return cached[1]
+
+    def rewrite(self, html):
+        """wraps every <img> that references a resizable image below /assets
+        into a <picture> with WebP and resized sources"""
+        if Image is None:
+            return html
+        return _img_re.sub(self._rewrite_tag, html)
+
+    def _rewrite_tag(self, match):
+        tag = match.group(0)
+        attrs = dict(_attr_re.findall(tag))
+        url = attrs.get("src", "")
+        if ("srcset" in attrs or not url.startswith("/assets/")
+                or not url.lower().endswith(raster_suffixes)):
+            return tag
+        src = Path(url.lstrip("/"))
+        variants = self._variants(src)
+        if not variants:
+            return tag
+        width = attrs.get("width", "")
+        sizes = f"{width}px" if width.isdigit() else default_sizes
+        full_width = self.dimensions(src)[0]
+
+        def srcset(fmt):
+            entries = [(w, "/" + _variant_output(src, w, f)) for w, f in variants if f == fmt]
+            if fmt != "webp":
+                entries.append((full_width, url))
+            return ", ".join(f"{u} {w}w" for w, u in entries)
+
+        end = len(tag) - (2 if tag.endswith("/>") else 1)
+        img = f'{tag[:end].rstrip()} srcset="{srcset("jpg")}" sizes="{sizes}"{tag[end:]}'
+        return (f'<picture><source type="image/webp" srcset="{srcset("webp")}" sizes="{sizes}">'
+                f'{img}</picture>')
+
+
+def _variant_output(src, width, fmt):
+    return str(src.with_name(f"{src.stem}-{width}w.{fmt}"))
+
+
+def _cache_path(cache_dir, src, *parts):
+    h = hashlib.sha256(version.encode())
+    h.update(src.read_bytes())
+    for part in parts:
+        h.update(f"\0{part}".encode())
+    digest = h.hexdigest()
+    return Path(cache_dir) / digest[:2] / digest[2:]
+
+
+def _store(path, save):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def make_variant(src, width, fmt, cache_dir):
+    """returns the path of src resized to width and saved as fmt"""
+    target = _cache_path(cache_dir, src, width, fmt).with_suffix("." + fmt)
+    if target.exists():
+        return target
+
+    def save(tmp):
+        with Image.open(src) as img:
+            if img.width > width:
+                img = img.resize((width, round(img.height * width / img.width)),
+                                 Image.Resampling.LANCZOS)
+            if fmt == "webp":
+                img.save(tmp, "WEBP", quality=80, method=4)
+            elif fmt == "png":
+                img.save(tmp, "PNG", optimize=True)
+            else:
+                img.convert("RGB").save(tmp, "JPEG", quality=82, optimize=True, progressive=True)
+
+    _store(target, save)
+    return target
+
+
+_svg_comment_re = re.compile(r"<!--.*?-->", re.S)
+_svg_metadata_re = re.compile(r"<metadata\b.*?</metadata>", re.S)
+_svg_keep_re = re.compile(r"(<(text|style)\b.*?</\2>)", re.S)
+_svg_path_re = re.compile(r'\bd="([^"]*)"')
+_number_re = re.compile(r"-?\d+\.\d+")
+_viewbox_re = re.compile(r'\bviewBox="[-\d.eE]+[ ,]+[-\d.eE]+[ ,]+([\d.eE]+)[ ,]+([\d.eE]+)"')
+
+
+def optimize_svg(src, cache_dir):
+    """returns the path of a minified copy of the SVG src. Comments, metadata
+    and whitespace between tags (except inside <text> and <style>) are
+    removed, and path coordinates are rounded to a precision relative to the
+    size of the viewBox, see _decimals()"""
+    target = _cache_path(cache_dir, src, "svg").with_suffix(".svg")
+    if target.exists():
+        return target
+    svg = src.read_text()
+    svg = _svg_comment_re.sub("", svg)
+    svg = _svg_metadata_re.sub("", svg)
+    # split returns the text between matches, the match, and its tag name
+    parts = _svg_keep_re.split(svg)
+    svg = "".join(part if i % 3 == 1 else re.sub(r">\s+<", "><", part)
+                  for i, part in enumerate(parts) if i % 3 != 2).strip()
+    decimals = _decimals(svg)
+    svg = _svg_path_re.sub(
+        lambda m: f'd="{_number_re.sub(lambda n: _round(n.group(0), decimals), m.group(1))}"',
+        svg)
+    _store(target, lambda tmp: tmp.write_text(svg))
+    return target
+
+
+def _decimals(svg):
+    """how many decimals coordinates keep: rounding moves them by less than
+    1/20000 of the larger side of the viewBox, which is invisible at any
+    size the image is shown. Without a viewBox it is 3, like svgo"""
+    m = _viewbox_re.search(svg)
+    try:
+        size = max(float(m.group(1)), float(m.group(2)))
+    except (AttributeError, ValueError):
+        return 3
+    if size <= 0:
+        return 3
+    return max(0, 4 - math.floor(math.log10(size)))
+
+
+def _round(number, decimals):
+    res = f"{float(number):.{decimals}f}"
+    if "." in res:
+        res = res.rstrip("0").rstrip(".")
+    return "0" if res == "-0" else res
@@ -0,0 +1,20 @@
+"""
+Markdown conversion with reused converters. Creating a Markdown instance
+loads and registers all extensions, which costs more than converting a
+short excerpt, so every thread keeps one configured instance and resets
+it between documents. Worker processes get their own through their own
+copy of this module.
+"""
+import threading
+
+import markdown as md
+
+extensions = ["extra", "codehilite", "mdx_math"]
+_local = threading.local()
+
+
+def convert(text):
+    converter = getattr(_local, "converter", None)
+    if converter is None:
+        converter = _local.converter = md.Markdown(extensions=extensions)
+    return converter.reset().convert(text)
@@ -0,0 +1,112 @@
+"""
+A persistent index of post metadata in SQLite: everything the index pages,
+archives, redirects and the search index need, plus size, mtime and hash
+of the source. Unchanged posts are loaded from here without reading their
+files, so only changed posts are parsed again, and the bodies of all other
+posts are only converted when their page is rendered.
+
+The index is cleared when its salt changes, e.g. with a new markdown
+version, as the excerpts are stored as html.
+"""
+import datetime as dt
+import json
+import sqlite3
+from pathlib import Path
+
+from .cache import file_hash
+
+schema_version = "1"
+_columns = ("path", "mtime_ns", "size", "hash", "title", "date", "link", "permalink",
+            "tags", "categories", "excerpt_sep", "excerpt", "terms")
+
+
+class PostIndex:
+    def __init__(self, db_path, *salt, enabled=True):
+        self.db_path = Path(db_path)
+        self.salt = "\0".join(map(str, (schema_version, *salt)))
+        self.enabled = enabled
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # serve moves the index to its rebuild thread, it is never used
+            # by two threads at once
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("create table if not exists meta (key text primary key, value text)")
+            row = self._db.execute("select value from meta where key = 'salt'").fetchone()
+            if row is None or row[0] != self.salt:
+                self._db.execute("drop table if exists posts")
+                self._db.execute("insert or replace into meta values ('salt', ?)", (self.salt,))
+            self._db.execute(f"create table if not exists posts ({', '.join(_columns)}, "
+                             "primary key (path))")
+        return self._db
+
+    def stale(self, paths):
+        """returns the paths that are not in the index, or whose content
+        changed. Files that were only touched are updated in place"""
+        if not self.enabled:
+            return list(paths)
+        known = {row[0]: row[1:] for row in
+                 self.db.execute("select path, mtime_ns, size, hash from posts")}
+        res = []
+        for path in paths:
+            st = path.stat()
+            entry = known.get(str(path))
+            if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+                continue
+            if entry is not None and entry[2] == file_hash(path):
+                self.db.execute("update posts set mtime_ns = ?, size = ? where path = ?",
+                                (st.st_mtime_ns, st.st_size, str(path)))
+                continue
+            res.append(path)
+        return res
+
+    def put(self, path, info, st):
+        """stores info, as returned by blog._parse_file, for path. st is the
+        stat result of path when it was read"""
+        self.db.execute(f"insert or replace into posts values ({', '.join('?' * len(_columns))})", (
+            str(path), st.st_mtime_ns, st.st_size, info["hash"], info["title"],
+            info["dt"].isoformat(), info["link"], info.get("extralink"),
+            json.dumps(info["tags"]), json.dumps(info["categories"]), info["excerpt_sep"],
+            info["excerpt"], json.dumps(info["terms"])))
+
+    def load(self, paths):
+        """returns the infos of paths, which must not be stale, in the same
+        form as blog._parse_file, and removes all other posts from the index"""
+        wanted = {str(p): p for p in paths}
+        res = {}
+        for row in self.db.execute(f"select {', '.join(_columns)} from posts"):
+            row = dict(zip(_columns, row))
+            path = wanted.get(row["path"])
+            if path is None:
+                self.db.execute("delete from posts where path = ?", (row["path"],))
+                continue
+            res[path] = _info(path, row)
+        self.db.commit()
+        return res
+
+    def commit(self):
+        if self._db is not None:
+            self._db.commit()
+
+
+def _info(path, row):
+    when = dt.datetime.fromisoformat(row["date"])
+    info = {
+        "title": row["title"],
+        "excerpt_sep": row["excerpt_sep"],
+        "excerpt": row["excerpt"],
+        "categories": json.loads(row["categories"]),
+        "tags": json.loads(row["tags"]),
+        "dt": when,
+        "link": row["link"],
+        "date": when.date(),
+        "source": str(path),
+        "hash": row["hash"],
+        "terms": json.loads(row["terms"]),
+    }
+    if row["permalink"] is not None:
+        info["extralink"] = row["permalink"]
+    return info
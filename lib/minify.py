@@ -0,0 +1,183 @@
+"""
+Minification of rendered html and css. Only changes that do not alter the
+rendering are made: whitespace is collapsed in text outside of pre, code,
+textarea, script and style, whitespace only text next to block level
+elements and in the head is dropped, and comments are removed. Elements
+that are not rendered, like script, are not block level, as the text
+around them flows together. Inline JavaScript only loses
+indentation and empty lines, as the scripts rely on automatic semicolon
+insertion. Whitespace is the ascii whitespace of html and css, a
+non-breaking space is text.
+
+minify_html() checks its result by comparing the parsed DOM of the input
+and the output, and returns the input unchanged if they differ.
+"""
+import re
+from html.parser import HTMLParser
+
+raw_tags = {"pre", "textarea", "script", "style", "code"}
+block_tags = {
+    "!doctype", "html", "head", "body", "div", "p", "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol",
+    "li", "dl", "dt", "dd", "table", "thead", "tbody", "tfoot", "tr", "td", "th",
+    "caption", "pre", "hr", "blockquote", "section", "article", "header", "footer",
+    "nav", "main", "aside", "figure", "figcaption", "form", "fieldset", "details",
+    "summary",
+}
+# the whitespace of html and css. str.isspace() and \s also match U+00A0,
+# the non-breaking space
+space = " \t\n\r\f"
+
+_space_re = re.compile(f"[{space}]+")
+_token_re = re.compile(
+    r"<!--.*?-->|<(pre|textarea|script|style|code)\b[^>]*>.*?</\1[ \t\n\r\f]*>|<[^>]*>|[^<]+",
+    re.S | re.I)
+_tag_name_re = re.compile(r"</?([!a-zA-Z][-a-zA-Z0-9]*)")
+_raw_re = re.compile(r"(<(script|style)\b[^>]*>)(.*?)(</\2[ \t\n\r\f]*>)", re.S | re.I)
+_js_types = ("", "text/javascript", "application/javascript", "module")
+
+
+def minify_html(html):
+    tokens = [m.group(0) for m in _token_re.finditer(html)]
+    out = []
+    in_head = False
+    for i, token in enumerate(tokens):
+        if token.startswith("<!--"):
+            if token.startswith("<!--[if"):
+                out.append(token)
+        elif token.startswith("<"):
+            in_head = _in_head(token, in_head)
+            out.append(_minify_raw(token))
+        elif not token.strip(space):
+            if not (in_head or _is_block(tokens, i - 1) or _is_block(tokens, i + 1)):
+                out.append(" ")
+        else:
+            out.append(_space_re.sub(" ", token))
+    res = "".join(out)
+    if _dom(html) != _dom(res):
+        print("minified html differs from the original, keeping it as it is")
+        return html
+    return res
+
+
+def minify_css(css):
+    # strings are kept as they are, everything between them is minified
+    parts = re.split(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')", css)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"/\*.*?\*/", "", parts[i], flags=re.S)
+        part = _space_re.sub(" ", part)
+        part = re.sub(r" ?([{};,>]) ?", r"\1", part)
+        part = part.replace(": ", ":")
+        parts[i] = part.replace(";}", "}")
+    return "".join(parts).strip(space)
+
+
+def minify_js(js):
+    """only removes indentation and empty lines, which is safe as long as
+    there are no template literals"""
+    if "`" in js:
+        return js
+    lines = (line.strip(space) for line in js.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def _minify_raw(token):
+    match = _raw_re.fullmatch(token)
+    if match is None:
+        return token
+    open_tag, name, body, close_tag = match.groups()
+    if name.lower() == "style":
+        body = minify_css(body)
+    else:
+        ctype = re.search(r'\btype="([^"]*)"', open_tag)
+        if (ctype.group(1) if ctype else "").lower() not in _js_types:
+            return token
+        body = minify_js(body)
+    return open_tag + body + close_tag
+
+
+def _in_head(token, in_head):
+    """whether the document is in its head after the tag token"""
+    match = _tag_name_re.match(token)
+    name = match.group(1).lower() if match else ""
+    if name == "head":
+        return not token.startswith("</")
+    return in_head and name != "body"
+
+
+def _is_block(tokens, i):
+    if i < 0 or i >= len(tokens) or not tokens[i].startswith("<"):
+        return i < 0 or i >= len(tokens)
+    match = _tag_name_re.match(tokens[i])
+    return match is not None and match.group(1).lower() in block_tags
+
+
+class _DomParser(HTMLParser):
+    """Flattens a document into a list of events, normalized the way a
+    browser would render them: whitespace in text is collapsed, and text that
+    is only whitespace is dropped next to block level elements and in the
+    head. Scripts are compared without indentation, styles without
+    whitespace and comments."""
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.events = []
+        self.raw = []
+        self.in_head = False
+
+    def handle_starttag(self, tag, attrs):
+        self.events.append(("start", tag, tuple(attrs)))
+        self.in_head = tag == "head" or (self.in_head and tag != "body")
+        if tag in raw_tags:
+            self.raw.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.events.append(("start", tag, tuple(attrs)))
+
+    def handle_endtag(self, tag):
+        self.events.append(("end", tag))
+        self.in_head = self.in_head and tag != "head"
+        if self.raw and self.raw[-1] == tag:
+            self.raw.pop()
+
+    def handle_data(self, data):
+        if self.in_head and not self.raw and not data.strip(space):
+            return
+        if self.raw and self.raw[-1] == "style":
+            data = re.sub(r"[ \t\n\r\f]+|/\*.*?\*/", "", data, flags=re.S).replace(";}", "}")
+        elif self.raw and self.raw[-1] == "script":
+            data = _space_re.sub("", data)
+        elif not self.raw:
+            data = _space_re.sub(" ", data)
+        if self.events and self.events[-1][0] == "data":
+            data = self.events.pop()[1] + data
+            if not self.raw:
+                data = _space_re.sub(" ", data)
+        self.events.append(("data", data))
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+    def handle_decl(self, decl):
+        self.events.append(("decl", decl))
+
+
+def _dom(html):
+    parser = _DomParser()
+    parser.feed(html)
+    parser.close()
+    events = []
+    for i, event in enumerate(parser.events):
+        if event[0] == "data" and event[1] in ("", " ") and (
+                _event_is_block(parser.events, i - 1) or _event_is_block(parser.events, i + 1)):
+            continue
+        events.append(event)
+    return events
+
+
+def _event_is_block(events, i):
+    if i < 0 or i >= len(events):
+        return True
+    return events[i][0] == "decl" or (events[i][0] in ("start", "end")
+                                      and events[i][1] in block_tags)
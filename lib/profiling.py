@@ -0,0 +1,106 @@
+"""
+Build profiling. Code marks stages with `with profiler.span(name)`, which
+costs nothing unless the profiler was started. Spans record wall time and
+memory, via tracemalloc: peak_kib is the most memory they had allocated
+at once, on top of what was allocated when they started, including that of
+nested spans. net_kib and net_blocks are what they allocated and did not
+free again, which is negative if they freed more. tracemalloc only knows
+live memory, so there is no total of all allocations. The spans can be
+written as a Chrome trace, which can be opened in chrome://tracing,
+Perfetto or speedscope.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+_null = nullcontext()
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._start = 0
+        # [memory at the start, highest peak so far] of the open spans
+        self._stack = []
+
+    def start(self):
+        self.enabled = True
+        self.events = []
+        self._stack = []
+        tracemalloc.start()
+        self._start = time.perf_counter_ns()
+
+    def stop(self):
+        self.enabled = False
+        tracemalloc.stop()
+
+    def span(self, name, cat="stage", **args):
+        if not self.enabled:
+            return _null
+        return self._span(name, cat, args)
+
+    @contextmanager
+    def _span(self, name, cat, args):
+        mem, peak = tracemalloc.get_traced_memory()
+        # the peak is reset for this span, so the enclosing one keeps its own
+        if self._stack:
+            self._stack[-1][1] = max(self._stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [mem, mem]
+        self._stack.append(frame)
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            mem, peak = tracemalloc.get_traced_memory()
+            self._stack.pop()
+            peak = max(frame[1], peak)
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            args["peak_kib"] = round((peak - frame[0]) / 1024, 1)
+            args["net_kib"] = round((mem - frame[0]) / 1024, 1)
+            args["net_blocks"] = sys.getallocatedblocks() - blocks
+            self.events.append(dict(
+                name=name, cat=cat, ph="X", pid=os.getpid(), tid=threading.get_ident(),
+                ts=(start - self._start) / 1000, dur=(end - start) / 1000, args=args))
+
+    def report(self, n=10):
+        """prints the total time and memory per stage, with the highest peak
+        of its calls, and the n slowest posts"""
+        stages = defaultdict(lambda: [0, 0, 0.0, 0.0, 0])
+        posts = defaultdict(float)
+        for e in self.events:
+            if e["cat"] == "post":
+                posts[e["name"]] += e["dur"]
+            else:
+                total = stages[e["name"]]
+                total[0] += 1
+                total[1] += e["dur"]
+                total[2] = max(total[2], e["args"]["peak_kib"])
+                total[3] += e["args"]["net_kib"]
+                total[4] += e["args"]["net_blocks"]
+        print(f"{'stage':<20} {'calls':>6} {'ms':>10} {'peak KiB':>10} {'net KiB':>10} "
+              f"{'net blocks':>10}")
+        for name, (calls, dur, peak, net, blocks) in sorted(stages.items(),
+                                                             key=lambda x: -x[1][1]):
+            print(f"{name:<20} {calls:>6} {dur / 1000:>10.1f} {peak:>10.1f} {net:>10.1f} "
+                  f"{blocks:>10}")
+        print("\nslowest posts:")
+        for name, dur in sorted(posts.items(), key=lambda x: -x[1])[:n]:
+            print(f"{dur / 1000:>10.1f} ms  {name}")
+
+    def write_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        print(f"wrote trace to {path}")
+
+
+profiler = Profiler()
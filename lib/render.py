@@ -1,8 +1,10 @@
+import hashlib
+import re
+from functools import cache
 from textwrap import dedent
 
-from .html import h, s
-from . import css
-import markdown as md
+from .html import h, s, static
+from . import css, markup
 
 
 style = css.style
@@ -10,14 +12,88 @@ style = css.style
 dark_brown = "#4e4a48"
 light_brown = "#e8dccd"
 
-def index(posts):
+def index(posts, page=1, has_next=False):
+    """renders one page of the index. posts are the posts on that page. If
+    there is more than one page, links to the newer and older pages are
+    added below the cards"""
     html = h.html[
         _index_header(),
-        _index_body(posts)
+        _index_body(posts, page, has_next)
     ]
     return f"<!DOCTYPE html>{html}"
 
 
+def page_link(page):
+    return "/index.html" if page == 1 else f"/page/{page}.html"
+
+
+def archive(kind, name, posts):
+    """renders the archive page of a tag or category (kind is "tags" or
+    "categories"), listing the cards of all its posts"""
+    heading = f"Posts tagged {name}" if kind == "tags" else f"Posts in {name}"
+    html = h.html[
+        h.head[
+            _head_meta("/common.css /index.css /code.css"),
+            h.title[f"Felix' Blog - {heading}"],
+            _mathjax_script()
+        ],
+        h.body[
+            h.div(id="body_container")[
+                _head_line(),
+                h.h1(klass="archive-title")[heading],
+                h.div(id='cards')[
+                    *(_card_index(info["title"], info["link"], info["date"], info["tags"],
+                                  info["categories"], info["excerpt"])
+                      for info in posts.values())
+                ]
+            ]
+        ]
+    ]
+    return f"<!DOCTYPE html>{html}"
+
+
+def search_page():
+    html = h.html[
+        h.head[
+            _head_meta("/common.css /index.css"),
+            h.title["Felix' Blog - Search"]
+        ],
+        h.body[
+            h.div(id="body_container")[
+                _head_line(),
+                s.input(type="search", id="search-box", placeholder="Search posts",
+                        autocomplete="off"),
+                h.div(id='cards'),
+            ],
+            h.script(src="/assets/search.js")
+        ]
+    ]
+    return f"<!DOCTYPE html>{html}"
+
+
+def archive_link(kind, name):
+    return f"/{kind}/{slug(name)}.html"
+
+
+def slug(name):
+    """the name of the archive page of a tag or category. Names that only
+    differ in case share a page. If characters are lost, like in C++ and
+    C#, a hash of the name keeps them apart"""
+    name = name.lower()
+    res = re.sub(r"[^a-z0-9]+", "-", name).strip("-")
+    if res != name:
+        res = f"{res}-{hashlib.sha1(name.encode()).hexdigest()[:6]}".lstrip("-")
+    return res
+
+
+def _archive_links(kind, names):
+    """links to the archive pages of names, which may end with a comma, as
+    they are split from the header of a post"""
+    names = [n.strip(",") for n in names or () if n.strip(",")]
+    return [part for i, name in enumerate(names)
+            for part in ([", "] if i else []) + [h.a(href=archive_link(kind, name))[name]]]
+
+
 def redirect_page(link):
     html = h.html[
         h.head[
@@ -29,8 +105,18 @@ def redirect_page(link):
     ]
     return f"<!DOCTYPE html>{html}"
     
+@cache
 def _index_header():
-    return h.head[
+    return static(h.head[
+        _head_meta("/common.css /index.css /code.css"),
+        h.title["Felix' Blog"],
+        _mathjax_script()
+    ])
+
+
+@cache
+def _head_meta(sheets):
+    return static(
         s.meta(charset="UTF-8"),
         *(s.meta(name=x[0], content=x[1]) for x in (
             ("description", "A blog, mostly about programming"),
@@ -38,58 +124,64 @@ def _index_header():
             ("author", "Felix Knorr"),
             ("viewport", "width=device-width, initial-scale=1"),
             ("google-site-verification", "nPdJMJTDyxfD2nSz55VURwJWrAb-Pv1DH0EEWvUxFlI"))),
-        *(s.link(rel="stylesheet", href=sheet) for sheet in "/common.css /index.css /code.css".split()),
-        s.link(rel="icon", href="/assets/logo.png", type="image/png"),
-        h.title["Felix' Blog"],
-        h.script(
-            src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.0/es5/startup.js",
-            integrity="sha512-LZZ88buOWCaSouKg9UNiW3N/vhBCprp0tpG9uNp+r6maXLDeBddAaqTmDduadI+WghoGaNlZG4NgCX0Xsxlfxg==",
-            crossorigin="anonymous", 
-            referrerpolicy="no-referrer")
-    ]
+        *(s.link(rel="stylesheet", href=sheet) for sheet in sheets.split()),
+        s.link(rel="icon", href="/assets/logo.png", type="image/png"))
+
+
+@cache
+def _mathjax_script():
+    return static(h.script(
+        src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.0/es5/startup.js",
+        integrity="sha512-LZZ88buOWCaSouKg9UNiW3N/vhBCprp0tpG9uNp+r6maXLDeBddAaqTmDduadI+WghoGaNlZG4NgCX0Xsxlfxg==",
+        crossorigin="anonymous", 
+        referrerpolicy="no-referrer"))
 
     
-def _index_body(posts):
+def _index_body(posts, page=1, has_next=False):
     return h.body[
         h.div(id="body_container")[
              _head_line(),
             h.p(id="welcome")["Welcome to my blog, where I write about programming (mostly) and other nerdy stuff (sometimes)."],
             h.a(href="/about_me.html", id="secondary-aboutme")["About Me"],
             h.div(id='cards')[
-                *(_card_index(info["title"], info["link"], info["date"], info["tags"], info["excerpt"])
+                *(_card_index(info["title"], info["link"], info["date"], info["tags"],
+                              info["categories"], info["excerpt"])
                     for info in posts.values())
-            ]
+            ],
+            *([_pagination(page, has_next)] if page > 1 or has_next else [])
         ]
     ]
 
-def _card_index(title, link, date, tags, content):
+
+def _pagination(page, has_next):
+    return h.div(id="pagination")[
+        h.a(href=page_link(page - 1), klass="newer")["Newer posts"] if page > 1 else h.span,
+        h.span(klass="page")[f"Page {page}"],
+        h.a(href=page_link(page + 1), klass="older")["Older posts"] if has_next else h.span
+    ]
+
+def _card_index(title, link, date, tags, categories, content):
     return h.div(klass="card")[
-        h.a(klass="header-a", href=link)[
-            h.div(klass="card-header")[
-                h.div(klass="left-half")[
-                    h.p(klass="title")[title],
-                    h.p(klass="tags")[*(tags if tags is not None else [])]
-                ],
-                h.p(klass="date")[date]
-            ]
-        ],
+        _card_header(h.a(klass="header-a", href="/" + link)[title], date, tags, categories),
         *([h.div(klass="card-content")[
             h.p[content]
           ]] if content != "" else [])
     ]
     
+@cache
 def _head_line():
-    return h.div(id="head_line")[
+    return static(h.div(id="head_line")[
         h.div(id="outer_head_row")[
             h.a(href="/index.html")[s.img(src='/assets/logo.png', alt="Blog Logo", width="100")],
             h.div(id="text_row")[
                 h.a(href="/index.html", id="title")["Felix Blog"],
                 h.div(klass="spacer"),
+                h.a(href='/search.html', id="search_link")["Search"],
                 h.a(href='/about_me.html', id="about_me")["About Me"]
             ],
         ],
         s.hr
-    ]
+    ])
     
 def about_me():
     html = h.html[
@@ -185,6 +277,7 @@ def _about_body():
      ]
 
 
+@cache
 def css_files():
     return {
         "common.css": _render_common_css(),
@@ -212,6 +305,26 @@ def _render_index_css():
                 "font-style": "italic",
                 "font-size": "100%",
             },
+            "#search-box": {
+                "width": "100%",
+                "box-sizing": "border-box",
+                "font-size": "18px",
+                "padding": "0.5em",
+                "margin-block": "1.5em",
+            },
+            ".archive-title": {
+                "text-align": "center",
+                "color": dark_brown,
+            },
+            "#pagination": {
+                "display": "flex",
+                "justify-content": "space-between",
+                "margin-block": "1.5em",
+                "a": {
+                    "color": dark_brown,
+                    "font-weight": "bold",
+                },
+            },
         }) + dedent("""
             @media all and (max-width: 50em) {
                 #body_container > #secondary-aboutme {
@@ -314,6 +427,11 @@ def _render_common_css():
         },
         '#title:hover': {"text-decoration-color": dark_brown}, 
         '#about_me': { 'font-weight': "bold" },
+        '#search_link': {
+            'font-weight': "bold",
+            'padding-right': "1em",
+        },
+        '#search_link:hover': {"text-decoration-color": dark_brown},
         '#about_me:hover': {"text-decoration-color": dark_brown},
         '.card': {
             'display': 'flex',
@@ -350,9 +468,14 @@ def _render_common_css():
                 "margin": "0",
                 "font-size": "12pt"
             },
+            '.categories': {
+                "margin": "0",
+                "font-size": "12pt"
+            },
+            'a': {"color": "inherit"},
+            'a:not(:hover)': {"text-decoration": "none"},
+            'a:hover': {"text-decoration-color": light_brown},
         },
-        'a.header-a:not(:hover)': {"text-decoration": "none"},
-        'a.header-a:hover': {"text-decoration-color": light_brown},
         'a.title': {
             "color": light_brown,
         },
@@ -373,45 +496,40 @@ def post(post):
 
 def _post_header(post):
     return h.head[
-        s.meta(charset="UTF-8"),
-        *(s.meta(name=x[0], content=x[1]) for x in (
-            ("description", "A blog, mostly about programming"),
-            ("keywords", "Programming, Rust, C, Python"),
-            ("author", "Felix Knorr"),
-            ("viewport", "width=device-width, initial-scale=1"),
-            ("google-site-verification", "nPdJMJTDyxfD2nSz55VURwJWrAb-Pv1DH0EEWvUxFlI"))),
-        *(s.link(rel="stylesheet", href=sheet) for sheet in "/common.css /code.css".split()),
-        s.link(rel="icon", href="/assets/logo.png", type="image/png"),
+        _head_meta("/common.css /code.css"),
         h.title[f"Felix' Blog - {post['title']}"],
-        h.script(
-            src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.0/es5/startup.js",
-            integrity="sha512-LZZ88buOWCaSouKg9UNiW3N/vhBCprp0tpG9uNp+r6maXLDeBddAaqTmDduadI+WghoGaNlZG4NgCX0Xsxlfxg==",
-            crossorigin="anonymous", 
-            referrerpolicy="no-referrer")
+        _mathjax_script()
     ]   
 
 def _post_body(post):
     return h.body[
         h.div(id="body_container")[
             _head_line(),
-            _card_post(post["title"], post["date"], post["tags"], post["post"])
+            _card_post(post["title"], post["date"], post["tags"], post["categories"],
+                       post["post"])
         ]
     ]   
 
-def _card_post(title, date, tags, content):
+def _card_post(title, date, tags, categories, content):
     return h.div(klass="card")[
-        h.div(klass="card-header")[
-            h.div(klass="left-half")[
-                h.p(klass="title")[title],
-                h.p(klass="tags")[*(tags if tags is not None else [])]
-            ],
-            h.p(klass="date")[date]
-        ],
+        _card_header(title, date, tags, categories),
         *([h.div(klass="card-content")[
             h.p[content]
           ]] if content != "" else [])
     ]
     
+def _card_header(title, date, tags, categories):
+    return h.div(klass="card-header")[
+        h.div(klass="left-half")[
+            h.p(klass="title")[title],
+            h.p(klass="tags")[*_archive_links("tags", tags)],
+            *([h.p(klass="categories")[*_archive_links("categories", categories)]]
+              if categories else [])
+        ],
+        h.p(klass="date")[date]
+    ]
+
+
 def md2html(s):
-    return md.markdown(dedent(s), extensions=["extra", "codehilite", "mdx_math"])
+    return markup.convert(dedent(s))
 
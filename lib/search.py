@@ -0,0 +1,155 @@
+"""
+A prebuilt inverted index for client side search. The plain text of every
+post is split into terms, and each term maps to the ids of the posts that
+contain it, with a weight. The index is sharded by the first prefix_len
+characters of the terms, so the browser only fetches the shards of the
+terms in a query (see assets/search.js). Shards are written as
+search/<prefix>.json, the list of posts as search/docs.json.
+
+Postings are flat lists [id, weight, id, weight, ...]. Ids are kept stable
+for as long as the SearchIndex lives, and across builds if it is given the
+docs of the last one. So a changed, added or removed post only changes the
+shards of its terms.
+"""
+import heapq
+import html
+import json
+import re
+import unicodedata
+from pathlib import Path
+
+# of tokenize, as the post index stores the terms of posts
+version = "2"
+
+prefix_len = 2
+max_term_len = 30
+title_weight = 5
+stopwords = frozenset("""
+    a an and are as at be but by for from has have he i if in into is it its
+    me my no not of on or so than that the their them then there these they
+    this to was we were what when which who will with you your
+""".split())
+
+_skip_re = re.compile(r"<(script|style)\b.*?</\1\s*>", re.S | re.I)
+_tag_re = re.compile(r"<[^>]*>")
+_term_re = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """splits plain text into lowercase ascii terms, without accents and
+    stopwords. Other characters separate terms, as in assets/search.js"""
+    text = "".join(c for c in unicodedata.normalize("NFKD", text)
+                   if not unicodedata.category(c).startswith("M")).lower()
+    return [t for t in _term_re.findall(text)
+            if prefix_len <= len(t) <= max_term_len and t not in stopwords]
+
+
+def html_text(markup):
+    return html.unescape(_tag_re.sub(" ", _skip_re.sub(" ", markup)))
+
+
+def post_terms(info):
+    """maps the terms of a post to their weight: the number of occurrences
+    in the text, plus title_weight per occurrence in the title"""
+    terms = {}
+    for term in tokenize(html_text(info["post"])):
+        terms[term] = terms.get(term, 0) + 1
+    for term in tokenize(info["title"] or ""):
+        terms[term] = terms.get(term, 0) + title_weight
+    return terms
+
+
+def shard_of(term):
+    return term[:prefix_len]
+
+
+class SearchIndex:
+    def __init__(self, last_docs=()):
+        """last_docs is the docs list of an earlier index. Posts with the
+        same link get the same id again"""
+        self.ids = {}
+        self.docs = [None] * len(last_docs)
+        self.reserved = {doc[0]: i for i, doc in enumerate(last_docs) if doc}
+        # a heap of the ids that are neither used nor reserved
+        self.free = [i for i, doc in enumerate(last_docs) if not doc]
+        self.terms = {}
+        self.shards = {}
+        self.dirty = set()
+
+    def update(self, path, info):
+        """adds or updates a post. The terms are taken from info["terms"] if
+        it has them, e.g. from the post index, otherwise from its html"""
+        terms = info["terms"] if "terms" in info else post_terms(info)
+        doc_id = self.ids.get(path)
+        if doc_id is None:
+            doc_id = self.reserved.pop(info["link"], None)
+            if doc_id is None:
+                doc_id = self._free_id()
+            self.ids[path] = doc_id
+        doc = [info["link"], info["title"], str(info["date"])]
+        if self.docs[doc_id] != doc:
+            self.docs[doc_id] = doc
+            self.dirty.add(None)
+        old = self.terms.get(path, {})
+        if old == terms:
+            return
+        self._unindex(doc_id, old.keys() - terms.keys())
+        for term, weight in terms.items():
+            if old.get(term) != weight:
+                self.shards.setdefault(shard_of(term), {}).setdefault(term, {})[doc_id] = weight
+                self.dirty.add(shard_of(term))
+        self.terms[path] = terms
+
+    def remove(self, path):
+        doc_id = self.ids.pop(path, None)
+        if doc_id is None:
+            return
+        self._unindex(doc_id, self.terms.pop(path))
+        self.docs[doc_id] = None
+        heapq.heappush(self.free, doc_id)
+        self.dirty.add(None)
+
+    def _free_id(self):
+        if self.free:
+            return heapq.heappop(self.free)
+        self.docs.append(None)
+        return len(self.docs) - 1
+
+    def _unindex(self, doc_id, terms):
+        for term in terms:
+            shard = self.shards[shard_of(term)]
+            del shard[term][doc_id]
+            if not shard[term]:
+                del shard[term]
+            self.dirty.add(shard_of(term))
+
+    def take_dirty(self):
+        """returns the shards that changed since the last call, as dict from
+        output to the data to write, or None if the shard is empty now. The
+        list of posts is included if it changed"""
+        res = {}
+        for shard in sorted(self.dirty, key=str):
+            if shard is None:
+                res["search/docs.json"] = {"docs": list(self.docs),
+                                           "stopwords": sorted(stopwords)}
+            elif self.shards.get(shard):
+                res[f"search/{shard}.json"] = {
+                    term: [x for item in sorted(postings.items()) for x in item]
+                    for term, postings in sorted(self.shards[shard].items())}
+            else:
+                self.shards.pop(shard, None)
+                res[f"search/{shard}.json"] = None
+        self.dirty.clear()
+        return res
+
+
+def load_docs(path):
+    """the docs list of the docs.json at path, or [] if there is none"""
+    try:
+        return json.loads(Path(path).read_text())["docs"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return []
+
+
+def render_json(data):
+    return json.dumps(data, separators=(",", ":"))
@@ -0,0 +1,202 @@
+"""
+The development server of `blog.py serve`. It serves the outputs of a build
+straight from memory, and tells open browser tabs to reload via Server-Sent
+Events whenever a rebuild finished. It runs on an asyncio event loop, so it
+keeps answering while a rebuild runs elsewhere, with the outputs as they
+were before.
+"""
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import traceback
+from http import HTTPStatus
+from pathlib import Path
+
+reload_path = "/__reload"
+reload_script = (f'<script>new EventSource("{reload_path}")'
+                 '.onmessage = () => location.reload()</script>').encode()
+compressible = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class DevServer:
+    """Serves outputs, a dict mapping paths to their content as str, or to a
+    Path of the file that should be served, or to a callable returning one of
+    those, which renders the output when it is requested. The dict is read on
+    every request, so updates to it are visible immediately. Rendering and
+    reading files runs in the default executor of the loop."""
+
+    def __init__(self, outputs, host="localhost", port=8080):
+        self.outputs = outputs
+        self.host = host
+        self.port = port
+        self.generation = 0
+        self._changed = None
+        self._responses = {}
+        self._server = None
+
+    async def start(self):
+        self._changed = asyncio.Event()
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        print(f"serving on http://{host}:{port}")
+
+    def notify_reload(self):
+        """must be called from the loop of the server"""
+        self.generation += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_reload(self, generation, timeout):
+        if self.generation == generation:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.generation
+
+    async def response(self, path):
+        """returns the _Response for path, or None. Responses are memoized as
+        long as the content of the output is unchanged"""
+        content = self.outputs.get(path)
+        if callable(content):
+            content = await asyncio.get_running_loop().run_in_executor(None, content)
+        if content is None:
+            return None
+        if isinstance(content, Path):
+            try:
+                st = content.stat()
+            except FileNotFoundError:
+                return None
+            version = (content, st.st_mtime_ns, st.st_size)
+        else:
+            version = content
+        cached = self._responses.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        res = await asyncio.get_running_loop().run_in_executor(None, _make_response, path,
+                                                               content)
+        self._responses[path] = (version, res)
+        return res
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while await self._serve_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_request(self, reader, writer):
+        """answers one request. Returns whether the connection stays open"""
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        method, target, version = (request_line.decode("latin-1").split() + ["", "", ""])[:3]
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if method not in ("GET", "HEAD"):
+            await _send(writer, HTTPStatus.METHOD_NOT_ALLOWED, {}, b"", keep_alive)
+            return keep_alive
+
+        path = target.partition("?")[0]
+        if path == reload_path:
+            await self._event_stream(writer)
+            return False
+        path = path.lstrip("/")
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        try:
+            res = await self.response(path)
+        except Exception:
+            traceback.print_exc()
+            await _send(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"Content-Type": "text/plain"},
+                        b"rendering failed, see the log of the server", keep_alive)
+            return keep_alive
+        if res is None:
+            await _send(writer, HTTPStatus.NOT_FOUND, {"Content-Type": "text/plain"},
+                        b"not found", keep_alive)
+            return keep_alive
+
+        gzipped = res.compressible and "gzip" in headers.get("accept-encoding", "")
+        etag = res.etag[:-1] + '-gz"' if gzipped else res.etag
+        if etag in map(str.strip, headers.get("if-none-match", "").split(",")):
+            await _send(writer, HTTPStatus.NOT_MODIFIED, {"ETag": etag}, b"", keep_alive)
+            return keep_alive
+        body = res.gzipped if gzipped else res.body
+        res_headers = {
+            "Content-Type": res.ctype,
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if gzipped:
+            res_headers["Content-Encoding"] = "gzip"
+        await _send(writer, HTTPStatus.OK, res_headers, body, keep_alive, method == "HEAD")
+        return keep_alive
+
+    async def _event_stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        generation = self.generation
+        while True:
+            new = await self.wait_reload(generation, timeout=15)
+            # a comment as keep alive, so closed tabs are noticed
+            writer.write(b"data: reload\n\n" if new != generation else b": ping\n\n")
+            await writer.drain()
+            generation = new
+
+
+class _Response:
+    def __init__(self, body, ctype):
+        self.body = body
+        self.ctype = ctype
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self._gzipped = None
+
+    @property
+    def compressible(self):
+        return self.ctype.startswith(compressible) and len(self.body) > 1024
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzipped
+
+
+def _make_response(path, content):
+    body = content.read_bytes() if isinstance(content, Path) else content.encode()
+    ctype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if ctype == "text/html":
+        body = _inject_reload(body)
+    res = _Response(body, ctype)
+    if res.compressible:
+        # compress here, in the executor, instead of on the loop
+        res.gzipped
+    return res
+
+
+def _inject_reload(body):
+    idx = body.rfind(b"</body>")
+    if idx == -1:
+        return body + reload_script
+    return body[:idx] + reload_script + body[idx:]
+
+
+async def _send(writer, status, headers, body, keep_alive, head_only=False):
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    if status != HTTPStatus.NOT_MODIFIED:
+        lines.append(f"Content-Length: {len(body)}")
+    if not keep_alive:
+        lines.append("Connection: close")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    if not head_only:
+        writer.write(body)
+    await writer.drain()
@@ -0,0 +1,175 @@
+"""
+File watching for `blog.py serve`. Uses inotify (via ctypes, so there is no
+extra dependency) where available, and falls back to polling otherwise.
+Both watchers pick up files and directories that are created after startup.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+
+_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+         | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+
+def watcher(dirs, files=(), debounce=0.03):
+    """Returns a watcher for the given directories (recursively) and single
+    files. Its wait() method blocks until something changed and returns the
+    set of changed paths."""
+    try:
+        return InotifyWatcher(dirs, files, debounce)
+    except OSError as e:
+        print(f"inotify unavailable ({e}), falling back to polling")
+        return PollingWatcher(dirs, files, debounce)
+
+
+def ignored(name):
+    """editor swap files, backups and bytecode"""
+    return (name.startswith(".") or name.endswith(("~", ".swp", ".swx", ".pyc"))
+            or name in ("__pycache__", "4913"))
+
+
+class InotifyWatcher:
+    def __init__(self, dirs, files, debounce):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("libc has no inotify")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.debounce = debounce
+        self.dirs = [Path(d) for d in dirs]
+        self.files = {Path(f) for f in files}
+        self._wds = {}
+        for d in self.dirs:
+            self._add_tree(d)
+        for d in {f.parent for f in self.files}:
+            self._add(d)
+
+    def _add(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"cannot watch {path}")
+        self._wds[wd] = path
+
+    def _add_tree(self, root):
+        """adds watches for root and all its subdirectories, and returns all
+        files found, which is needed for directories that were created (or
+        moved in) with content"""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not ignored(d)]
+            self._add(Path(dirpath))
+            found += [Path(dirpath, f) for f in filenames if not ignored(f)]
+        return found
+
+    def _wanted(self, path):
+        return path in self.files or any(d in path.parents for d in self.dirs)
+
+    def _read(self):
+        changed = set()
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+            name = buf[offset + _EVENT.size: offset + _EVENT.size + length]
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so report everything
+                changed.update(self.dirs)
+                changed.update(self.files)
+                continue
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            parent = self._wds.get(wd)
+            name = os.fsdecode(name.rstrip(b"\0"))
+            if parent is None or not name or ignored(name):
+                continue
+            path = parent / name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path.is_dir():
+                    changed.update(self._add_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM) and self._wanted(path):
+                    changed.add(path)
+                continue
+            if self._wanted(path):
+                changed.add(path)
+        return changed
+
+    def wait(self):
+        changed = set()
+        while not changed:
+            select.select([self._fd], [], [])
+            changed = self._read()
+            # merge bursts of events (editors often write, rename and chmod
+            # on save) into one change set
+            while select.select([self._fd], [], [], self.debounce)[0]:
+                changed |= self._read()
+        return changed
+
+
+class PollingWatcher:
+    def __init__(self, dirs, files, debounce, interval=0.3):
+        self.dirs = [Path(d) for d in dirs]
+        self.files = [Path(f) for f in files]
+        self.debounce = debounce
+        self.interval = interval
+        self._state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for f in self.files:
+            try:
+                st = f.stat()
+                state[f] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+        for root in self.dirs:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not ignored(d)]
+                for name in filenames:
+                    if ignored(name):
+                        continue
+                    path = Path(dirpath, name)
+                    try:
+                        st = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    state[path] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def _poll(self):
+        new = self._scan()
+        old = self._state
+        self._state = new
+        return {p for p in old.keys() | new.keys() if old.get(p) != new.get(p)}
+
+    def wait(self):
+        while not (changed := self._poll()):
+            time.sleep(self.interval)
+        time.sleep(self.debounce)
+        return changed | self._poll()
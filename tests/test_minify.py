@@ -0,0 +1,171 @@
+"""
+Checks minify_html against its input, by a rendering model that is
+independent of the one lib/minify.py uses: the text a reader sees (with
+the whitespace rules of CSS for display: block and inline), the elements
+and their attributes, and the content of pre, textarea, code, script and
+style.
+"""
+import re
+from html.parser import HTMLParser
+
+import pytest
+
+from lib import minify
+
+# elements with display: block (or similar) in the default style sheet
+rendered_blocks = {
+    "html", "body", "address", "article", "aside", "blockquote", "dd", "details", "div",
+    "dl", "dt", "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3",
+    "h4", "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+    "summary", "table", "caption", "thead", "tbody", "tfoot", "tr", "td", "th", "ul",
+}
+# elements whose content is never rendered
+hidden = {"head", "title", "script", "style", "template", "noscript"}
+verbatim = {"pre", "textarea", "code", "script", "style"}
+# not \s, which also matches the non-breaking space
+spaces = r"[ \t\n\r\f]+"
+
+
+class _Rendering(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.segments = []
+        self.elements = []
+        self.raw = []
+        self._open = []
+
+    def handle_starttag(self, tag, attrs):
+        self.elements.append((tag, sorted(attrs)))
+        if tag in rendered_blocks:
+            self.segments.append(None)
+        if tag in hidden or tag in verbatim:
+            self._open.append([tag, ""])
+
+    def handle_startendtag(self, tag, attrs):
+        self.elements.append((tag, sorted(attrs)))
+        if tag in rendered_blocks:
+            self.segments.append(None)
+
+    def handle_endtag(self, tag):
+        if self._open and self._open[-1][0] == tag:
+            name, content = self._open.pop()
+            self.raw.append((name, content))
+        if tag in rendered_blocks:
+            self.segments.append(None)
+
+    def handle_data(self, data):
+        for entry in self._open:
+            entry[1] += data
+        if any(name in hidden for name, _ in self._open):
+            return
+        keep = any(name in ("pre", "textarea") for name, _ in self._open)
+        self.segments.append(("pre", data) if keep else ("text", data))
+
+
+def rendered_text(html):
+    """the text as rendered: lines are split at block boundaries, runs of
+    whitespace collapse into one space, and whitespace at the start and end
+    of a line is not shown"""
+    parser = _Rendering()
+    parser.feed(html)
+    parser.close()
+    lines, line = [], ""
+    for segment in parser.segments + [None]:
+        if segment is None:
+            lines.append(line.strip(" "))
+            line = ""
+        elif segment[0] == "pre":
+            line += segment[1].replace(" ", "\0")
+        else:
+            line = re.sub(spaces, " ", line + re.sub(spaces, " ", segment[1]))
+    return [line.replace("\0", " ") for line in lines if line]
+
+
+def contents(html):
+    parser = _Rendering()
+    parser.feed(html)
+    parser.close()
+    res = []
+    for name, content in parser.raw:
+        if name == "script":
+            # automatic semicolon insertion needs the line breaks
+            content = [line.strip(" \t\r\f") for line in content.split("\n")]
+            content = [line for line in content if line]
+        elif name == "style":
+            content = re.sub(spaces + r"|/\*.*?\*/", "", content, flags=re.S).replace(";}", "}")
+        elif name in hidden:
+            continue
+        res.append((name, content))
+    return parser.elements, res
+
+
+def assert_same_rendering(html):
+    res = minify.minify_html(html)
+    assert rendered_text(res) == rendered_text(html)
+    assert contents(res) == contents(html)
+    return res
+
+
+def test_space_between_inline_elements_around_script():
+    html = "<p><span>a</span> <script>x=1</script> <span>b</span></p>"
+    assert rendered_text(html) == ["a b"]
+    assert_same_rendering(html)
+
+
+@pytest.mark.parametrize("tag", ["script", "link", "meta"])
+def test_unrendered_elements_are_not_blocks(tag):
+    assert tag not in minify.block_tags
+    element = "<script>x = 1</script>" if tag == "script" else f'<{tag} name="x">'
+    assert_same_rendering(f"<body><p>one {element} two</p>\n<p>three</p></body>")
+
+
+def test_whitespace_next_to_blocks_and_in_head_is_dropped():
+    html = ("<!DOCTYPE html>\n<html>\n<head>\n  <meta charset=\"UTF-8\"/>\n"
+            "  <title>t</title>\n</head>\n<body>\n  <div>\n    <p>some   text</p>\n"
+            "  </div>\n</body>\n</html>\n")
+    res = assert_same_rendering(html)
+    assert res == ('<!DOCTYPE html><html><head><meta charset="UTF-8"/><title>t</title>'
+                   "</head><body><div><p>some text</p></div></body></html>")
+
+
+def test_non_breaking_spaces_are_kept():
+    html = "<div>\xa0<p>a\xa0 b \xa0\xa0c</p>\n\xa0</div>"
+    assert rendered_text(html) == ["\xa0", "a\xa0 b \xa0\xa0c", "\xa0"]
+    res = assert_same_rendering(html)
+    assert res == "<div>\xa0<p>a\xa0 b \xa0\xa0c</p> \xa0</div>"
+
+
+def test_pre_and_code_are_kept():
+    html = ("<div>\n<pre>  indented\n\n    more  </pre>\n"
+            "<p>inline <code>a   b</code>  text</p></div>")
+    res = assert_same_rendering(html)
+    assert "<pre>  indented\n\n    more  </pre>" in res
+    assert "<code>a   b</code>" in res
+
+
+def test_inline_script_keeps_line_breaks():
+    script = """
+        let a = 1
+        let b = a
+        ;(function () { return b })()
+    """
+    res = assert_same_rendering(f"<body><p>x</p><script>{script}</script></body>")
+    assert "let a = 1\nlet b = a\n;(function () { return b })()" in res
+
+
+def test_scripts_with_template_literals_are_kept():
+    script = "const s = `a\n    b`"
+    res = assert_same_rendering(f"<body><script>{script}</script></body>")
+    assert script in res
+
+
+def test_comments_are_removed_except_conditional_ones():
+    html = "<p>a <!-- note --> b</p><!--[if IE]><p>old</p><![endif]-->"
+    res = assert_same_rendering(html)
+    assert "note" not in res
+    assert "<!--[if IE]>" in res
+
+
+def test_rendered_page():
+    from lib import render
+    assert_same_rendering(render.about_me())